@@ -0,0 +1,371 @@
+import random
+import sys
+import time
+
+from book import start_board
+from grid import Grid
+from partb import iter_overflow, np, overflow_batch, OverflowCache
+from player1 import PlayerOne
+from player2 import PlayerTwo
+from partd import evaluate_board, evaluate_boards, EndgameSolver, GameTree, SearchBoard, TranspositionTable
+
+# Benchmarks for the search and overflow code
+# Run "python bench.py" for all of them or "python bench.py parallel" for one
+
+# Function to build a random mid-game board: roughly fill of the cells hold pieces,
+# each below the number that makes it overflow
+def random_board(rng, height, width, fill):
+    board = [[0] * width for _ in range(height)]
+    for row in range(height):
+        for col in range(width):
+            capacity = (row > 0) + (row < height - 1) + (col > 0) + (col < width - 1)
+            if rng.random() < fill and capacity > 1:
+                board[row][col] = rng.randint(1, capacity - 1) * rng.choice([1, -1])
+    return board
+
+# Compares the single-process search with process-pool root search for several worker counts
+def bench_parallel(worker_counts=(1, 2, 4, 8, 16), boards=8, depth=5):
+    rng = random.Random(1)
+    positions = [random_board(rng, 5, 6, 0.4) for _ in range(boards)]
+    print("parallel root search, %d boards of 5x6, depth %d" % (boards, depth))
+    base = None
+    for workers in worker_counts:
+        if workers > 1:
+            GameTree(positions[0], 1, lazy=True, max_depth=1, workers=workers).get_move()  # start the pool
+        start = time.perf_counter()
+        for board in positions:
+            GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 9, max_depth=depth,
+                     workers=workers).get_move()
+        elapsed = time.perf_counter() - start
+        if base is None:
+            base = elapsed
+        print("  workers %2d: %.2fs  speedup %.2fx" % (workers, elapsed, base / elapsed))
+
+# Function to build a board where every cell is one piece short of overflowing, with a few cells
+# belonging to player 2, and one piece just added in the middle, so the cascade spreads everywhere
+def loaded_board(rng, size):
+    board = [[0] * size for _ in range(size)]
+    for row in range(size):
+        for col in range(size):
+            capacity = (row > 0) + (row < size - 1) + (col > 0) + (col < size - 1)
+            board[row][col] = (capacity - 1) * (-1 if rng.random() < 0.1 else 1)
+    board[size // 2][size // 2] = abs(board[size // 2][size // 2]) + 1
+    return board
+
+# Times partb.iter_overflow with the pure Python and NumPy backends on square boards of growing
+# size, for cascades that sweep the whole board (loaded) and ones that stay local (random)
+def bench_numpy(sizes=(5, 10, 15, 20, 30, 50, 100, 150), boards=5):
+    if np is None:
+        print("numpy backend: numpy is not installed")
+        return
+    rng = random.Random(1)
+    print("overflow backends, %d boards per size" % boards)
+    for size in sizes:
+        loaded = [loaded_board(rng, size) for _ in range(boards)]
+        local = []
+        for _ in range(boards):
+            board = random_board(rng, size, size, 0.8)
+            board[size // 2][size // 2] = 4
+            local.append(board)
+        for name, positions in (("loaded", loaded), ("random", local)):
+            times = {}
+            for backend in ("python", "numpy"):
+                start = time.perf_counter()
+                waves = 0
+                for board in positions:
+                    for _ in iter_overflow(Grid.from_lists(board), backend):
+                        waves += 1
+                times[backend] = time.perf_counter() - start
+            print("  %3dx%-3d %s %5d waves  python %.4fs  numpy %.4fs  numpy speedup %.2fx"
+                  % (size, size, name, waves, times["python"], times["numpy"], times["python"] / times["numpy"]))
+
+# Times resolving the children of many positions one board at a time and as one batch
+def bench_batch(sizes=((5, 6), (10, 10), (20, 20)), positions=200):
+    if np is None:
+        print("batch overflow: numpy is not installed")
+        return
+    rng = random.Random(1)
+    print("batch overflow, every move of %d random positions" % positions)
+    for height, width in sizes:
+        children = []
+        for _ in range(positions):
+            board = random_board(rng, height, width, 0.7)
+            for row in range(height):
+                for col in range(width):
+                    if board[row][col] >= 0:
+                        child = [r[:] for r in board]
+                        child[row][col] += 1
+                        children.append(child)
+        start = time.perf_counter()
+        one_by_one = [sum(1 for _ in iter_overflow(Grid.from_lists(child))) for child in children]
+        single = time.perf_counter() - start
+        stack = np.array(children)
+        start = time.perf_counter()
+        batched = overflow_batch(stack)
+        batch = time.perf_counter() - start
+        assert batched == one_by_one
+        print("  %3dx%-3d %6d boards  one at a time %.3fs  batch %.3fs  speedup %.2fx"
+              % (height, width, len(children), single, batch, single / batch))
+
+# Measures leaves scored per second by evaluate_board one board at a time and by evaluate_boards
+# on a ready-made block, then times the eager GameTree's minimax with and without batching
+def bench_evaluate(sizes=((5, 6), (10, 10)), blocks=(1, 4, 16, 64, 256, 1024), leaves=20000, positions=5):
+    if np is None:
+        print("vectorised evaluation: numpy is not installed")
+        return
+    rng = random.Random(2)
+    print("leaves scored per second")
+    for height, width in sizes:
+        for size in blocks:
+            boards = [random_board(rng, height, width, 0.7) for _ in range(size)]
+            stack = np.array(boards, dtype=np.int8)
+            repeats = max(1, leaves // size)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                scalar = [evaluate_board(board, 1) for board in boards]
+            single = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(repeats):
+                vector = evaluate_boards(stack, 1)
+            block = time.perf_counter() - start
+            assert vector == scalar
+            print("  %3dx%-3d block %5d  scalar %9.0f/s  vectorised %9.0f/s  speedup %.2fx"
+                  % (height, width, size, size * repeats / single, size * repeats / block, single / block))
+    print("eager minimax (depth 3) per position, 5x6")
+    for fill in (0.6, 0.4, 0.2):
+        times = {False: 0.0, True: 0.0}
+        for _ in range(positions):
+            board = random_board(rng, 5, 6, fill)
+            values = {}
+            for batch in (False, True):
+                tree = GameTree(board, 1, tree_height=3, batch=batch)
+                start = time.perf_counter()
+                values[batch] = [tree.minimax(child, False) for child in tree.root.children]
+                times[batch] += time.perf_counter() - start
+            assert values[False] == values[True]
+        print("  fill %.1f  per leaf %.4fs  batched %.4fs  speedup %.2fx"
+              % (fill, times[False] / positions, times[True] / positions, times[False] / times[True]))
+
+# Times playing the same moves again with and without an OverflowCache, as sibling search nodes,
+# repeated bot turns and replays do
+def bench_cache(positions=200, repeats=5):
+    rng = random.Random(1)
+    moves = []
+    for _ in range(positions):
+        board = random_board(rng, 5, 6, 0.8)
+        for row in range(5):
+            for col in range(6):
+                if board[row][col] >= 0:
+                    moves.append((board, row, col))
+    print("overflow cache, %d moves played %d times" % (len(moves), repeats))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for board, row, col in moves:
+            grid = Grid.from_lists(board)
+            grid.set(row, col, grid.get(row, col) + 1)
+            for _ in iter_overflow(grid):
+                pass
+    plain = time.perf_counter() - start
+    cache = OverflowCache(len(moves))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for board, row, col in moves:
+            cache.play(Grid.from_lists(board), row, col, 1)
+    cached = time.perf_counter() - start
+    print("  no cache %.3fs  cache %.3fs  speedup %.2fx  %s" % (plain, cached, plain / cached, cache.stats()))
+
+# Function to play one game between two bots the way game.py does, without the window
+# The first opening moves are random valid moves drawn from seed, so games differ
+# Returns 1 or -1 for the winner (a bot choosing an invalid move loses), or 0 after max_moves moves
+def play_game(bots, height=5, width=6, max_moves=200, seed=0, opening=4):
+    rng = random.Random(seed)
+    board = [[0] * width for _ in range(height)]
+    board[0][0] = 1
+    board[height - 1][width - 1] = -1
+    player = 1
+    for turn in range(max_moves):
+        if turn < opening:
+            row, col = rng.choice([(r, c) for r in range(height) for c in range(width) if board[r][c] * player >= 0])
+        else:
+            row, col = bots[0 if player == 1 else 1].get_play([r[:] for r in board])
+        if board[row][col] * player < 0:
+            return -player
+        board[row][col] += player
+        for _ in iter_overflow(board):
+            pass
+        if not any(value > 0 for r in board for value in r):
+            return -1
+        if not any(value < 0 for r in board for value in r):
+            return 1
+        player = -player
+    return 0
+
+# Plays bots searching the real game rules against bots searching placements only, with the
+# same node budget per move, and compares how well each search prunes
+def bench_rules(games=10, node_limit=2000):
+    print("game rules against placement rules, %d games, %d nodes per move" % (games, node_limit))
+    results = {"game": 0, "placement": 0, "draw": 0}
+    for game in range(games):
+        rules = ("game", "placement") if game % 2 == 0 else ("placement", "game")
+        bots = [PlayerOne(node_limit=node_limit, rules=rules[0]), PlayerTwo(node_limit=node_limit, rules=rules[1])]
+        winner = play_game(bots, seed=game // 2)  # each opening is played from both sides
+        if winner == 0:
+            results["draw"] += 1
+        else:
+            results[rules[0] if winner == 1 else rules[1]] += 1
+    print("  wins: %s" % results)
+
+    rng = random.Random(1)
+    positions = []
+    for _ in range(20):
+        board = random_board(rng, 5, 6, 0.5)
+        board[0][0], board[4][5] = 1, -1
+        positions.append(board)
+    for rules in ("placement", "game"):
+        expanded = cutoffs = first = nodes = 0
+        for board in positions:
+            tree = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 9, max_depth=4,
+                            rules=rules)
+            tree.get_move()
+            nodes += tree.nodes
+            expanded += tree.stats.expanded
+            cutoffs += tree.stats.cutoffs
+            first += tree.stats.first_move_cutoffs
+        print("  %-9s depth 4: %7d nodes  cut-off rate %.2f  first-move cut-offs %.2f"
+              % (rules, nodes, cutoffs / expanded, first / max(cutoffs, 1)))
+
+# Plays bots with quiescence against bots without, with the same node budget per move
+def bench_quiescence(games=10, node_limit=2000, quiescence_nodes=64):
+    print("quiescence (%d nodes per leaf) against none, %d games, %d nodes per move"
+          % (quiescence_nodes, games, node_limit))
+    results = {"quiescence": 0, "none": 0, "draw": 0}
+    for game in range(games):
+        budgets = (quiescence_nodes, 0) if game % 2 == 0 else (0, quiescence_nodes)
+        bots = [PlayerOne(node_limit=node_limit, quiescence_nodes=budgets[0]),
+                PlayerTwo(node_limit=node_limit, quiescence_nodes=budgets[1])]
+        winner = play_game(bots, seed=game // 2)
+        if winner == 0:
+            results["draw"] += 1
+        else:
+            results["quiescence" if budgets[0 if winner == 1 else 1] else "none"] += 1
+    print("  wins: %s" % results)
+
+# Counts the distinct positions of every placement line up to depth plies from an empty board,
+# telling positions apart by hash and by symmetry class
+def bench_symmetry(sizes=((5, 6), (5, 5), (6, 6)), depth=3):
+    print("symmetry classes of placement positions, %d plies from an empty board" % depth)
+    for height, width in sizes:
+        board = SearchBoard([[0] * width for _ in range(height)], 1, symmetry=True)
+        plain = set()
+        classes = set()
+
+        def visit(ply):
+            plain.add(board.hash)
+            classes.add(board.table_key()[0])
+            if ply == depth:
+                return
+            for move in list(board.moves()):
+                board.play(move)
+                visit(ply + 1)
+                board.undo()
+        visit(0)
+        print("  %dx%d: %7d positions  %6d classes (%.1fx fewer)"
+              % (height, width, len(plain), len(classes), len(plain) / len(classes)))
+
+# Plays the MCTS engine against alpha-beta on a larger board, with the same time per move
+def bench_mcts(games=4, size=8, time_limit=0.2):
+    print("mcts against alphabeta on %dx%d, %d games, %.1fs per move" % (size, size, games, time_limit))
+    results = {"mcts": 0, "alphabeta": 0, "draw": 0}
+    for game in range(games):
+        engines = ("mcts", "alphabeta") if game % 2 == 0 else ("alphabeta", "mcts")
+        bots = [PlayerOne(time_limit=time_limit, engine=engines[0], playouts=10 ** 9),
+                PlayerTwo(time_limit=time_limit, engine=engines[1], playouts=10 ** 9)]
+        winner = play_game(bots, size, size, seed=game // 2)
+        if winner == 0:
+            results["draw"] += 1
+        else:
+            results[engines[0] if winner == 1 else engines[1]] += 1
+    print("  wins: %s" % results)
+
+# Runs the endgame solver on crowded positions and compares its answers and time with a 3 ply
+# game-rules search
+def bench_endgame(positions=100, node_limit=20000):
+    rng = random.Random(1)
+    boards = []
+    while len(boards) < positions:
+        board = random_board(rng, 3, 4, 0.95)
+        board[0][0] = abs(board[0][0]) or 1
+        if any(value < 0 for row in board for value in row):
+            boards.append(board)
+    print("endgame solver on %d crowded 3x4 positions, %d nodes each" % (positions, node_limit))
+    solver = EndgameSolver(node_limit)
+    results = {EndgameSolver.WIN: 0, EndgameSolver.LOSS: 0, EndgameSolver.UNKNOWN: 0}
+    agree = 0
+    start = time.perf_counter()
+    for board in boards:
+        result, _, move = solver.solve(SearchBoard(board, 1, "game"))
+        results[result] += 1
+        if result == EndgameSolver.WIN:
+            child = SearchBoard(board, 1, "game")
+            child.play(move)
+            agree += child.winner() == 1 or solver.lookup(child.hash) is not None
+    solved = time.perf_counter() - start
+    start = time.perf_counter()
+    for board in boards:
+        GameTree(board, 1, lazy=True, rules="game").get_move()
+    searched = time.perf_counter() - start
+    print("  won %d, lost %d, unknown %d (winning moves checked: %d)  solver %.2fs  3 ply search %.2fs"
+          % (results[EndgameSolver.WIN], results[EndgameSolver.LOSS], results[EndgameSolver.UNKNOWN], agree,
+             solved, searched))
+    start = time.perf_counter()
+    for board in boards:
+        solver.solve(SearchBoard(board, 1, "game"))
+    print("  solving them again from the table: %.3fs" % (time.perf_counter() - start))
+    bench_endgame_bots()
+
+# Function to collect positions late in random 5x6 games where player 1 has at most moves moves
+def endgame_boards(rng, count, moves=8, height=5, width=6):
+    boards = []
+    while len(boards) < count:
+        board = SearchBoard(start_board(height, width), 1, "game")
+        while board.winner() == 0:
+            legal = list(board.moves())
+            if board.player == 1 and len(legal) <= moves:
+                boards.append(board.to_lists())
+                break
+            board.play(rng.choice(legal))
+    return boards
+
+# Times the bots' moves in endgame positions at their defaults (the solver on, time_limit as in
+# game.py) against the same bots without the solver: every move should keep to the time limit
+def bench_endgame_bots(positions=50, time_limit=1.0):
+    boards = endgame_boards(random.Random(3), positions)
+    print("bots on %d 5x6 endgame positions, time_limit %.1fs" % (positions, time_limit))
+    for endgame_moves in (8, 0):
+        times = []
+        for board in boards:
+            bot = PlayerOne(time_limit=time_limit, endgame_moves=endgame_moves)
+            start = time.perf_counter()
+            bot.get_play(board)
+            times.append(time.perf_counter() - start)
+        print("  endgame_moves=%d  mean %.3fs  max %.3fs  over the limit by 5%%: %d"
+              % (endgame_moves, sum(times) / len(times), max(times),
+                 sum(1 for t in times if t > time_limit * 1.05)))
+
+BENCHMARKS = {
+    "parallel": bench_parallel,
+    "numpy": bench_numpy,
+    "batch": bench_batch,
+    "evaluate": bench_evaluate,
+    "cache": bench_cache,
+    "rules": bench_rules,
+    "quiescence": bench_quiescence,
+    "symmetry": bench_symmetry,
+    "mcts": bench_mcts,
+    "endgame": bench_endgame,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
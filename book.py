@@ -0,0 +1,116 @@
+import mmap
+import struct
+import sys
+import time
+
+from partd import GameTree, SearchBoard, TranspositionTable, hash_board
+
+# Opening book: the move the bots' search picks for each position near the start of a game,
+# worked out once and saved, so the emptiest (and most expensive) positions are not searched again
+# Build one with "python book.py [plies] [node_limit] [file]"
+
+# File layout (little-endian): a header, then one record per position, sorted by hash
+#   header: magic, rows, cols, plies the book covers, number of records
+#   record: Zobrist hash of the position with the player to move (partd.hash_board), row, col
+HEADER = struct.Struct('<4sHHHI')
+RECORD = struct.Struct('<QBB')
+MAGIC = b'OBK1'
+
+BOOK_FILE = "opening_book.bin"
+
+# Function to build the starting board of game.py
+def start_board(rows=5, cols=6):
+    board = [[0] * cols for _ in range(rows)]
+    board[0][0] = 1
+    board[rows - 1][cols - 1] = -1
+    return board
+
+# Function to work out the book moves for every position up to plies moves from the start
+# search is a function (board, player) returning (row, col); by default a game-rules search
+# like the bots' with node_limit nodes
+# Returns a dict {hash of the position with the player to move: (row, col)}
+def build_book(plies=2, node_limit=20000, rows=5, cols=6, search=None, progress=False):
+    if search is None:
+        def search(board, player):
+            tree = GameTree(board, player, lazy=True, table=TranspositionTable(), node_limit=node_limit,
+                            rules="game", quiescence_nodes=64)
+            return tree.get_move()
+    book = {}
+    level = [(start_board(rows, cols), 1)]
+    for ply in range(plies + 1):
+        following = []
+        for board, player in level:
+            key = hash_board(board, player)
+            if key in book:
+                continue  # Reached by another move order
+            book[key] = search(board, player)
+            if ply == plies:
+                continue
+            position = SearchBoard(board, player, "game")
+            for move in list(position.moves()):
+                position.play(move)
+                if position.winner() == 0:
+                    following.append((position.to_lists(), -player))
+                position.undo()
+        if progress:
+            print("ply %d: %d positions in the book" % (ply, len(book)))
+        level = following
+    return book
+
+# Function to save a book built by build_book to path
+def write_book(path, book, rows=5, cols=6, plies=0):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, rows, cols, plies, len(book)))
+        for key in sorted(book):
+            row, col = book[key]
+            f.write(RECORD.pack(key, row, col))
+
+# Class to look moves up in a book file without loading it: the file is memory-mapped and
+# searched by bisection over its sorted fixed-size records, so only the pages touched are read
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.rows, self.cols, self.plies, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not an opening book" % path)
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the book move (row, col) for the board with player to move, or None if the
+    # position is not in the book
+    def lookup(self, board, player):
+        if len(board) != self.rows or len(board[0]) != self.cols:
+            return None
+        key = hash_board(board, player)
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, row, col = RECORD.unpack_from(self.map, HEADER.size + middle * RECORD.size)
+            if record_key < key:
+                low = middle + 1
+            elif record_key > key:
+                high = middle
+            else:
+                self.hits += 1
+                return (row, col)
+        self.misses += 1
+        return None
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+if __name__ == "__main__":
+    plies = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    node_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    path = sys.argv[3] if len(sys.argv) > 3 else BOOK_FILE
+    start = time.perf_counter()
+    book = build_book(plies, node_limit, progress=True)
+    write_book(path, book, plies=plies)
+    print("wrote %d positions to %s in %.1fs" % (len(book), path, time.perf_counter() - start))
@@ -0,0 +1,127 @@
+from book import OpeningBook
+from mcts import MCTS
+from partd import EndgameSolver, GameTree, Ponderer, TranspositionTable, hash_board
+
+# Search bot for either side of the board: player is 1 (PlayerOne) or -1 (PlayerTwo)
+class Bot:
+
+    # table_size and replacement configure the transposition table used by deepening searches
+    # time_limit (seconds per move) or node_limit turn on iterative deepening, which goes as deep
+    # as the budget allows unless max_depth is given; without a budget the search is 3 plies deep
+    # workers > 1 splits each search's root moves across that many processes
+    # rules is what the search plays (see partd.SearchBoard): "game" for the real moves and
+    # overflow, "placement" for pieces on empty cells only, as the original minimax did (mirror
+    # images and rotations then share transposition table entries)
+    # quiescence_nodes is how many nodes each leaf of a game-rules search may spend following
+    # chain reactions past the search depth (0 turns quiescence off)
+    # book is the path of an opening book (see book.py) to play from before searching
+    # endgame_moves: with the game rules, once the bot has at most this many moves an endgame
+    # solver looking endgame_plies ahead (within endgame_nodes nodes) tries to prove a win first
+    # engine picks the search: "alphabeta" (partd.GameTree) or "mcts" (mcts.MCTS, which runs
+    # playouts playouts per move, or fewer if time_limit runs out first; the search options
+    # above other than time_limit and reuse are for alphabeta only)
+    # stats_log is the path of a file to append the partd.SearchStats of every alphabeta search
+    # the bot runs for its move to, one JSON object per line
+    def __init__(self, player, name, table_size = 1 << 16, replacement = "depth",
+                 time_limit = None, node_limit = None, max_depth = None, workers = 1, reuse = True,
+                 ponder = False, rules = "game", quiescence_nodes = 64,
+                 book = None, engine = "alphabeta", playouts = 1000, endgame_moves = 8,
+                 endgame_plies = 7, endgame_nodes = 20000, stats_log = None):
+        if engine not in ("alphabeta", "mcts"):
+            raise ValueError("engine must be 'alphabeta' or 'mcts'")
+        self.player = player
+        self.name = name
+        self.table_size = table_size
+        self.replacement = replacement
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.workers = workers
+        self.rules = rules
+        self.quiescence_nodes = quiescence_nodes
+        # With reuse the transposition table and the expected line of play are kept between moves,
+        # so a reply the bot already looked at does not have to be searched again from scratch
+        self.reuse = reuse
+        self.table = TranspositionTable(table_size, replacement) if reuse else None
+        self.expected = None  # (hash of the position expected next, line of play from it)
+        # With ponder the bot keeps searching the opponent's likely replies while they think
+        self.ponderer = Ponderer(self.search) if ponder else None
+        self.book = OpeningBook(book) if book is not None else None
+        self.engine = engine
+        self.playouts = playouts
+        self.mcts = None  # MCTS tree of the last move, kept with reuse
+        self.endgame_moves = endgame_moves if rules == "game" else 0
+        self.endgame_plies = endgame_plies
+        self.endgame_nodes = endgame_nodes
+        # Proven positions stay proven, so with reuse the solver and its table are kept
+        self.solver = EndgameSolver(endgame_nodes, endgame_plies) if reuse else None
+        self.stats_log = stats_log
+        # SearchStats of the alphabeta search behind the last move (None if the move came from the
+        # book, pondering or MCTS)
+        self.last_stats = None
+
+    def get_name(self):
+        return self.name
+
+    # Function to run the bot's search for a position
+    # Returns the move, the position expected next (see GameTree.expected_position) and the
+    # opponent reply the search expects, as a cell index (or None)
+    def search(self, board, stop_event = None):
+        if self.engine == "mcts":
+            return self.search_mcts(board, stop_event)
+        if self.reuse:
+            table = self.table
+        else:
+            # The table only saves work once positions repeat across iterations of a deepening search
+            table = None
+            if self.time_limit is not None or self.node_limit is not None:
+                table = TranspositionTable(self.table_size, self.replacement)
+        solver = None
+        if self.endgame_moves > 0:
+            solver = self.solver if self.reuse else EndgameSolver(self.endgame_nodes, self.endgame_plies)
+        tree = GameTree(board, self.player, lazy=True, table=table,
+                        time_limit=self.time_limit, node_limit=self.node_limit, max_depth=self.max_depth,
+                        workers=self.workers, stop_event=stop_event, rules=self.rules,
+                        quiescence_nodes=self.quiescence_nodes, symmetry=self.rules == "placement",
+                        solver=solver, endgame_moves=self.endgame_moves)
+        # Re-root on the actual position: if the opponent replied as expected, carry on along the same line
+        if self.expected is not None and self.expected[0] == tree.board.hash:
+            tree.pv = self.expected[1]
+        move = tree.get_move()
+        if stop_event is None:
+            self.last_stats = tree.stats
+        reply = tree.pv[1] if len(tree.pv) > 1 else None
+        return move, tree.expected_position(), reply
+
+    # Function to run the MCTS engine for a position
+    # With reuse the tree of the last move is carried over if it reached this position
+    # (pondering searches get a tree of their own)
+    def search_mcts(self, board, stop_event = None):
+        tree = self.mcts
+        if stop_event is not None or not self.reuse or tree is None or not tree.reroot(board):
+            tree = MCTS(board, self.player, playouts=self.playouts, time_limit=self.time_limit, stop_event=stop_event)
+        if stop_event is None and self.reuse:
+            self.mcts = tree
+        return tree.get_move(), None, None
+
+    def get_play(self, board):
+        result = None
+        self.last_stats = None
+        if self.ponderer is not None:
+            self.ponderer.stop()
+            result = self.ponderer.take(hash_board(board, self.player))
+        if result is None and self.book is not None:
+            move = self.book.lookup(board, self.player)
+            if move is not None:
+                result = move, None, None
+        if result is None:
+            # Not pondered (or the opponent's move was not predicted): search now
+            result = self.search(board)
+        (row,col), expected, reply = result
+        if self.stats_log is not None and self.last_stats is not None:
+            self.last_stats.log(self.stats_log, name=self.name, move=[row, col])
+        if self.reuse:
+            self.expected = expected
+        if self.ponderer is not None:
+            self.ponderer.start(board, row * len(board[0]) + col, self.player, reply)
+        return (row,col)
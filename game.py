@@ -1,11 +1,13 @@
 import pygame
+import os
 import sys
 import math
 
-from partb import overflow
-from parta import Queue
+from partb import iter_overflow, apply_delta
+from grid import Grid
 from player1 import PlayerOne
 from player2 import PlayerTwo 
+from book import BOOK_FILE
 
 class Dropdown:
     def _init_(self, x, y, width, height, options):
@@ -120,14 +122,14 @@ class Board:
                 return 1
         return 0
 
-    def do_overflow(self,q):
-        oldboard = []
-        for i in range(self.height):
-            oldboard.append(self.board[i].copy())
-        numsteps = overflow(self.board, q)
-        if(numsteps != 0):
-            self.set(oldboard)
-        return numsteps
+    # Returns a generator working out the overflow on a flat copy of the board one wave at a time.
+    # Each wave is yielded as a delta, leaving the board itself for the animation to step through
+    # with apply
+    def do_overflow(self):
+        return iter_overflow(Grid.from_lists(self.board))
+
+    def apply(self, delta):
+        apply_delta(self.board, delta)
     
     def set(self, newboard):
         for row in range(self.height):
@@ -204,6 +206,9 @@ BLACK = (0, 0, 0)
 X_OFFSET = 0
 Y_OFFSET = 100
 FULL_DELAY = 5
+BOT_TIME_LIMIT = 1.0  # seconds a bot may think per move
+# bots play the opening from the book built by "python book.py" if there is one
+BOT_BOOK = BOOK_FILE if os.path.exists(BOOK_FILE) else None
 
 # hate the colours?  there are other options.  Just change the lines below to another colour's file name.  
 # the following are available blue, pink, yellow, orange, grey, green
@@ -241,11 +246,11 @@ current_player = 0
 board = Board(GRID_SIZE[1], GRID_SIZE[0], p1_sprites, p2_sprites)
 # Game loop
 running = True
-overflow_boards = Queue()
+overflow_waves = None
+next_wave = None
 overflowing = False
-numsteps = 0
 has_winner = False
-bots = [PlayerOne(), PlayerTwo()]
+bots = [PlayerOne(time_limit=BOT_TIME_LIMIT, book=BOT_BOOK), PlayerTwo(time_limit=BOT_TIME_LIMIT, book=BOT_BOOK)]
 grid_col = -1
 grid_row = -1
 choice = [None, None]
@@ -274,10 +279,10 @@ while running:
     if not has_winner:
         if overflowing:
             status[0] = "Overflowing"
-            if not overflow_boards.is_empty():
+            if next_wave is not None:
                 if repeat_step == FULL_DELAY:
-                    next = overflow_boards.dequeue()
-                    board.set(next)
+                    board.apply(next_wave)
+                    next_wave = next(overflow_waves, None) # the next wave is only worked out now
                     repeat_step = 0
                 else:
                     repeat_step += 1
@@ -305,8 +310,9 @@ while running:
 
             if make_move:
                 board.add_piece(grid_row, grid_col, player_id[current_player])
-                numsteps = board.do_overflow(overflow_boards)
-                if numsteps != 0:
+                overflow_waves = board.do_overflow()
+                next_wave = next(overflow_waves, None)
+                if next_wave is not None:
                     overflowing = True
                     repeat_step = 0
                 else:
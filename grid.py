@@ -0,0 +1,131 @@
+from array import array
+
+MASK64 = (1 << 64) - 1
+
+# Function to mix an integer into a well spread 64-bit value (splitmix64 finaliser)
+def mix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+# Key xored into the hash whenever the player to move changes
+SIDE_KEY = mix64(0x5EED)
+
+_zobrist_keys = {}
+
+# Function to get the Zobrist key for a cell index holding a value
+# Keys are derived from the cell and value alone, so hashes are the same in every process
+# Empty cells have key 0, so a hash only depends on the occupied cells
+def zobrist_key(index, value):
+    if value == 0:
+        return 0
+    key = _zobrist_keys.get((index, value))
+    if key is None:
+        key = mix64((index << 16) ^ (value & 0xFFFF))
+        _zobrist_keys[(index, value)] = key
+    return key
+
+# Class to hold what every board of one size shares: the neighbours of each cell and how many
+# pieces make it overflow. Cells are numbered row by row (index = row * cols + col)
+class Shape:
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.size = rows * cols
+        # Neighbours of each cell in row-major order (up, left, right, down)
+        self.neighbours = []
+        for row in range(rows):
+            for col in range(cols):
+                cell = []
+                if row > 0:
+                    cell.append((row - 1) * cols + col)
+                if col > 0:
+                    cell.append(row * cols + col - 1)
+                if col < cols - 1:
+                    cell.append(row * cols + col + 1)
+                if row < rows - 1:
+                    cell.append((row + 1) * cols + col)
+                self.neighbours.append(tuple(cell))
+        self.neighbours = tuple(self.neighbours)
+        # A cell overflows once it holds as many pieces as it has neighbours
+        self.capacity = bytes(len(cell) for cell in self.neighbours)
+        # Mirror images and rotations that map the board onto itself, each as a tuple giving the
+        # cell every cell goes to (identity first): the two mirrors and the half turn, and on
+        # square boards the quarter turns and diagonal mirrors as well
+        transforms = [lambda r, c: (r, c), lambda r, c: (rows - 1 - r, c),
+                      lambda r, c: (r, cols - 1 - c), lambda r, c: (rows - 1 - r, cols - 1 - c)]
+        if rows == cols:
+            transforms += [lambda r, c: (c, r), lambda r, c: (cols - 1 - c, rows - 1 - r),
+                           lambda r, c: (c, rows - 1 - r), lambda r, c: (cols - 1 - c, r)]
+        self.symmetries = []
+        for transform in transforms:
+            cells = []
+            for index in range(self.size):
+                row, col = transform(index // cols, index % cols)
+                cells.append(row * cols + col)
+            self.symmetries.append(tuple(cells))
+        self.symmetries = tuple(self.symmetries)
+        # The inverse of each symmetry, to map cells back
+        self.inverses = tuple(tuple(sorted(range(self.size), key=cells.__getitem__)) for cells in self.symmetries)
+
+_shapes = {}
+
+# Function to get the shared Shape for boards with the given number of rows and columns
+# Each shape is built once and reused by every board of that size
+def get_shape(rows, cols):
+    shape = _shapes.get((rows, cols))
+    if shape is None:
+        shape = Shape(rows, cols)
+        _shapes[(rows, cols)] = shape
+    return shape
+
+# Class to represent a board as one flat array of signed bytes (-128 to 127 pieces per cell)
+# Positive values are player 1's pieces, negative values player 2's, 0 is an empty cell
+class Grid:
+    def __init__(self, rows, cols, cells=None):
+        self.shape = get_shape(rows, cols)
+        if cells is None:
+            self.cells = array('b', bytes(self.shape.size))
+        else:
+            self.cells = array('b', cells)
+            if len(self.cells) != self.shape.size:
+                raise ValueError("expected %d cells, got %d" % (self.shape.size, len(self.cells)))
+
+    # Function to build a Grid from a board given as a list of rows
+    @classmethod
+    def from_lists(cls, board):
+        return cls(len(board), len(board[0]), [value for row in board for value in row])
+
+    # Function to convert the grid back to a list of rows
+    def to_lists(self):
+        cols = self.shape.cols
+        cells = self.cells.tolist()
+        return [cells[row * cols:(row + 1) * cols] for row in range(self.shape.rows)]
+
+    # Returns a copy of the grid (one flat array copy)
+    def copy(self):
+        grid = Grid.__new__(Grid)
+        grid.shape = self.shape
+        grid.cells = array('b', self.cells)
+        return grid
+
+    def rows(self):
+        return self.shape.rows
+
+    def cols(self):
+        return self.shape.cols
+
+    # Function to get the value at (row, col)
+    def get(self, row, col):
+        return self.cells[row * self.shape.cols + col]
+
+    # Function to set the value at (row, col)
+    def set(self, row, col, value):
+        self.cells[row * self.shape.cols + col] = value
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and self.shape is other.shape and self.cells == other.cells
+
+    def __len__(self):
+        return self.shape.size
@@ -0,0 +1,139 @@
+import math
+import random
+import time
+
+from partd import SearchBoard
+
+# Monte Carlo tree search (UCT) over the real game rules, an alternative to partd.GameTree's
+# alpha-beta for boards too big to search a few plies deep. Positions are played and taken back
+# on one partd.SearchBoard, overflow included, both down the tree and in the random playouts
+
+# Class to search a position with UCT, with the same get_move() as partd.GameTree
+# playouts is the number of playouts per move; time_limit (seconds) stops the search earlier
+# exploration is the UCT constant: higher values spread the playouts over more moves
+# playout_moves caps the length of a playout; a playout cut off there is won by whoever is
+# ahead on pieces (partd.evaluate_board), or drawn
+# Setting stop_event (a threading.Event) stops the search as if its budget had run out
+class MCTS:
+
+    # Inner class for a position in the tree, reached by playing move from its parent
+    class Node:
+        def __init__(self, parent, move, mover, key, moves, winner):
+            self.parent = parent
+            self.move = move  # Cell index played to get here (None at the root)
+            self.mover = mover  # Player who played move
+            self.key = key  # Hash of the position, with the player to move
+            self.untried = moves  # Moves not expanded yet, in the order they will be tried
+            self.winner = winner  # 1 or -1 if the game is over here, else 0
+            self.children = []
+            self.visits = 0
+            self.wins = 0.0  # Playout results for the player who made move (a draw counts half)
+
+    def __init__(self, board, player, playouts=1000, time_limit=None, exploration=1.4, playout_moves=100,
+                 seed=None, stop_event=None):
+        self.player = player  # Player who will make the move
+        self.playouts = playouts
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.playout_moves = playout_moves
+        self.random = random.Random(seed)
+        self.stop_event = stop_event
+        self.board = SearchBoard(board, player, "game")
+        self.root = self.new_node(None, None)
+        self.completed = 0  # Playouts run by the last get_move
+
+    # Function to create the node for the current position of the search board
+    def new_node(self, parent, move):
+        board = self.board
+        winner = board.winner() if move is not None else 0
+        moves = [] if winner != 0 else list(board.moves())
+        self.random.shuffle(moves)
+        return self.Node(parent, move, -board.player, board.hash, moves, winner)
+
+    # Function to get the best move for the current player: the root move played out most often
+    def get_move(self):
+        start = time.perf_counter()
+        self.completed = 0
+        while self.completed < self.playouts:
+            if self.time_limit is not None and time.perf_counter() - start >= self.time_limit:
+                break
+            if self.stop_event is not None and self.stop_event.is_set():
+                break
+            self.playout()
+            self.completed += 1
+        if not self.root.children:
+            for move in self.board.moves():
+                return divmod(move, self.board.width)
+            return None
+        best = max(self.root.children, key=lambda child: child.visits)
+        return divmod(best.move, self.board.width)
+
+    # Function to run one playout: select down the tree by UCT, add one node, play randomly to
+    # the end of the game (or playout_moves moves), then credit the result back up the tree
+    def playout(self):
+        board = self.board
+        node = self.root
+        while not node.untried and node.children:
+            node = self.select(node)
+            board.play(node.move)
+        if node.untried and node.winner == 0:
+            move = node.untried.pop()
+            board.play(move)
+            child = self.new_node(node, move)
+            node.children.append(child)
+            node = child
+        winner = node.winner if node.winner != 0 else self.rollout()
+        while board.marks:
+            board.undo()
+        while node is not None:
+            node.visits += 1
+            if winner == node.mover:
+                node.wins += 1
+            elif winner == 0:
+                node.wins += 0.5
+            node = node.parent
+
+    # Function to pick the child to follow, by the UCT score
+    def select(self, node):
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        return max(node.children,
+                   key=lambda child: child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits))
+
+    # Function to play random moves from the current position until someone wins
+    # Returns the winner (1 or -1), or 0 for a draw; the moves are left on the board for playout
+    # to take back
+    def rollout(self):
+        board = self.board
+        choice = self.random.choice
+        for _ in range(self.playout_moves):
+            moves = list(board.moves())
+            if not moves:
+                break
+            board.play(choice(moves))
+            winner = board.winner()
+            if winner != 0:
+                return winner
+        score = board.evaluate(1)
+        if score > 0:
+            return 1
+        if score < 0:
+            return -1
+        return 0
+
+    # Function to carry the tree over to the next move: board is the position the player now
+    # faces, after its last move and the opponent's reply
+    # Returns True if that position was already in the tree (its playouts are kept), False if
+    # the search starts again from scratch
+    def reroot(self, board):
+        self.board = SearchBoard(board, self.player, "game")
+        key = self.board.hash
+        for child in self.root.children:
+            for grandchild in child.children:
+                if grandchild.key == key:
+                    grandchild.parent = None
+                    grandchild.move = None
+                    self.root = grandchild
+                    return True
+        self.root = self.new_node(None, None)
+        return False
@@ -1,10 +1,32 @@
+from array import array
+
 from parta import Queue
+from partc import HashTable
+from grid import Grid, get_shape, zobrist_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Boards with at least this many cells use the NumPy backend when numpy is installed.
+# "python bench.py numpy" shows NumPy ahead from about 10x10 on cascades that sweep the board
+# and from about 30x30 on small local ones; 20x20 is in between
+NUMPY_MIN_CELLS = 400
 
 # grid: A 2D list representing the grid of numbers.
 # Returns:
 #   A list of tuples (row, col) indicating the cells that will overflow.
 #   Returns None if no cells will overflow.
 def get_overflow_list(grid):
+    if isinstance(grid, Grid):
+        # Flat board: compare each cell with the precomputed capacity of its position
+        cells = grid.cells
+        capacity = grid.shape.capacity
+        cols = grid.cols()
+        overflow_list = [divmod(i, cols) for i in range(len(cells)) if cells[i] != 0 and abs(cells[i]) >= capacity[i]]
+        return overflow_list or None
+
     overflow_list = []
     numRows = len(grid)
     numCols = len(grid[0])
@@ -35,6 +57,14 @@ def get_overflow_list(grid):
 #   True if the grid contains cells with different signs and has one or more cells in an overflow state.
 #   Returns False otherwise.
 def check_sign_overflow_status(grid):
+    if isinstance(grid, Grid):
+        cells = grid.cells
+        sign = 1 if cells[0] > 0 else -1
+        for i in range(1, len(cells)):
+            if cells[i] != 0 and (1 if cells[i] > 0 else -1) != sign:
+                return True
+        return False
+
     sign = None
     for row in range(len(grid)):
         for col in range(len(grid[0])):
@@ -48,58 +78,396 @@ def check_sign_overflow_status(grid):
                     return True # Return True if there is a cell with a different sign
     return False
 
+# Works out one wave of overflow on a flat list (or array) of cells.
+# cells: The cells, numbered row by row; not changed.
+# neighbours: The neighbours of each cell, in row-major order (see grid.Shape).
+# overflow_list: The indexes of the overflowing cells, in increasing order.
+# Returns a dict {index: new value} for every cell the wave touches.
+# Each overflowing cell is emptied and gives one piece of its colour to each neighbour,
+# taking the neighbour over if it belongs to the other player.
+def spread(cells, neighbours, overflow_list):
+    changes = {}
+    for i in overflow_list:
+        changes[i] = 0
+    for i in overflow_list:
+        sign = 1 if cells[i] > 0 else -1
+        for n in neighbours[i]:
+            value = changes.get(n, cells[n])
+            if value * sign < 0:
+                value = -value # Adjust the sign of the neighbour
+            changes[n] = value + sign
+    return changes
+
+# Works out the overflow of the grid one wave at a time.
+# grid: A 2D list representing the grid of numbers, or a Grid. It is updated in place.
+# backend: "python", "numpy", or None to use numpy on boards of NUMPY_MIN_CELLS or more
+#   when it is installed. Both backends go through the same waves.
+# Yields, after each wave has been applied to grid, a list of (row, col, new value) for the
+# cells that wave changed. Nothing is computed until the next wave is asked for, so a caller
+# can show a wave while the rest of the cascade is still to come, and a caller that only wants
+# the final grid can run the generator to the end and ignore what it yields.
+def iter_overflow(grid, backend=None):
+    if backend is None:
+        size = len(grid) if isinstance(grid, Grid) else len(grid) * len(grid[0])
+        backend = "numpy" if np is not None and size >= NUMPY_MIN_CELLS else "python"
+    if backend == "numpy":
+        return iter_overflow_numpy(grid)
+    if backend != "python":
+        raise ValueError("unknown overflow backend: %r" % (backend,))
+    return iter_overflow_python(grid)
+
+# Pure Python backend of iter_overflow.
+# The waves are worked out in a loop rather than by recursion. A cell can only start to overflow
+# after a wave changed it, so after the first wave only the cells the last wave touched are
+# examined, and the piece count of each colour is kept up to date so the check_sign_overflow_status
+# test is O(1). Pieces are never created, so a cascade either settles or comes back to a grid it
+# has already been through; it would then repeat forever, so it is stopped there.
+def iter_overflow_python(grid):
+    is_grid = isinstance(grid, Grid)
+    if is_grid:
+        cells = grid.cells
+        shape = grid.shape
+    else:
+        cells = [value for row in grid for value in row]
+        shape = get_shape(len(grid), len(grid[0]))
+    numCols = shape.cols
+    capacity = shape.capacity
+    neighbours = shape.neighbours
+
+    positive = sum(1 for value in cells if value > 0)
+    negative = sum(1 for value in cells if value < 0)
+    key = 0 # Zobrist hash of the changes since the start; equal keys mean equal grids
+    seen = {key}
+    candidates = range(len(cells))
+    while True:
+        overflow_list = sorted(i for i in candidates if cells[i] != 0 and abs(cells[i]) >= capacity[i])
+        if not overflow_list:
+            return
+        # Same test as check_sign_overflow_status: the sign of the first cell (empty counts as
+        # negative) against every other cell
+        if not (negative > 0 if cells[0] > 0 else positive > 0):
+            return
+
+        changes = spread(cells, neighbours, overflow_list)
+        delta = []
+        for i, value in changes.items():
+            old = cells[i]
+            if old == value:
+                continue
+            delta.append((i // numCols, i % numCols, value))
+            if old > 0:
+                positive -= 1
+            elif old < 0:
+                negative -= 1
+            if value > 0:
+                positive += 1
+            elif value < 0:
+                negative += 1
+            key ^= zobrist_key(i, old) ^ zobrist_key(i, value)
+            cells[i] = value
+            if not is_grid:
+                grid[i // numCols][i % numCols] = value
+        yield delta
+
+        if key in seen:
+            return # The cascade has started to repeat itself
+        seen.add(key)
+        candidates = changes
+
+_capacity_arrays = {}
+
+# Function to get the capacity of every cell of a shape as a NumPy array of rows x cols
+def capacity_array(shape):
+    capacity = _capacity_arrays.get((shape.rows, shape.cols))
+    if capacity is None:
+        capacity = np.frombuffer(shape.capacity, dtype=np.uint8).astype(np.int64)
+        capacity = capacity.reshape(shape.rows, shape.cols)
+        _capacity_arrays[(shape.rows, shape.cols)] = capacity
+    return capacity
+
+# Works out one wave of overflow with NumPy, the array counterpart of spread.
+# board: An integer array whose last two axes are rows and columns; any axes before them
+#   hold separate boards (see overflow_batch). Not changed.
+# over: A boolean array of the same shape marking the overflowing cells.
+# Returns the boards after the wave.
+# Within a wave, a cell next to k overflowing cells ends up with k more pieces than it kept
+# (none if it overflowed itself) and the colour of the last of them in row-major order, which
+# is the one below it, else the one to its right, then left, then above. The shifted adds below
+# build exactly that, so the waves are the same as spread's.
+def numpy_wave(board, over):
+    sign = np.sign(board) * over
+    count = np.zeros_like(board)
+    last = np.zeros_like(board)
+    # Pieces from the cell above, then left, right and below; later ones set the colour
+    count[..., 1:, :] += over[..., :-1, :]
+    last[..., 1:, :] = np.where(over[..., :-1, :], sign[..., :-1, :], last[..., 1:, :])
+    count[..., :, 1:] += over[..., :, :-1]
+    last[..., :, 1:] = np.where(over[..., :, :-1], sign[..., :, :-1], last[..., :, 1:])
+    count[..., :, :-1] += over[..., :, 1:]
+    last[..., :, :-1] = np.where(over[..., :, 1:], sign[..., :, 1:], last[..., :, :-1])
+    count[..., :-1, :] += over[..., 1:, :]
+    last[..., :-1, :] = np.where(over[..., 1:, :], sign[..., 1:, :], last[..., :-1, :])
+    kept = np.where(over, 0, np.abs(board))
+    return np.where(count > 0, (kept + count) * last, np.where(over, 0, board))
+
+# NumPy backend of iter_overflow: each wave is a handful of whole-array operations.
+def iter_overflow_numpy(grid):
+    if np is None:
+        raise ImportError("the numpy overflow backend needs numpy installed")
+    is_grid = isinstance(grid, Grid)
+    if is_grid:
+        shape = grid.shape
+        board = np.frombuffer(grid.cells, dtype=np.int8).astype(np.int64)
+    else:
+        shape = get_shape(len(grid), len(grid[0]))
+        board = np.array(grid, dtype=np.int64).ravel()
+    cols = shape.cols
+    board = board.reshape(shape.rows, cols)
+    capacity = capacity_array(shape)
+
+    seen = {board.tobytes()}
+    while True:
+        over = (np.abs(board) >= capacity) & (board != 0)
+        if not over.any():
+            return
+        # Same test as check_sign_overflow_status
+        if not ((board < 0).any() if board[0, 0] > 0 else (board > 0).any()):
+            return
+
+        new = numpy_wave(board, over)
+        changed = np.flatnonzero(new != board)
+        values = new.ravel()[changed].tolist()
+        delta = [(i // cols, i % cols, value) for i, value in zip(changed.tolist(), values)]
+        if is_grid:
+            np.frombuffer(grid.cells, dtype=np.int8)[:] = new.ravel()
+        else:
+            for row, col, value in delta:
+                grid[row][col] = value
+        board = new
+        yield delta
+
+        key = board.tobytes()
+        if key in seen:
+            return # The cascade has started to repeat itself
+        seen.add(key)
+
+# Resolves the overflow of many boards of the same size together.
+# boards: A 3-D NumPy integer array (boards x rows x cols), or a list of boards of one size
+#   (2D lists or Grids). The boards are updated in place to their final state.
+# Returns a list with the number of waves each board went through.
+# Every wave is worked out for all the boards still overflowing in one numpy_wave call; a board
+# drops out of the batch as soon as it settles (or starts to repeat), so a long cascade on one
+# board does not slow down the rest. Without numpy the boards are resolved one at a time.
+def overflow_batch(boards):
+    if len(boards) == 0:
+        return []
+    if np is None:
+        waves = []
+        for board in boards:
+            waves.append(sum(1 for _ in iter_overflow_python(board)))
+        return waves
+
+    if isinstance(boards, np.ndarray):
+        work = boards.astype(np.int64)
+    elif isinstance(boards[0], Grid):
+        work = np.array([np.frombuffer(grid.cells, dtype=np.int8) for grid in boards], dtype=np.int64)
+        work = work.reshape(len(boards), boards[0].rows(), boards[0].cols())
+    else:
+        work = np.array(boards, dtype=np.int64)
+    count, rows, cols = work.shape
+    capacity = capacity_array(get_shape(rows, cols))
+
+    waves = np.zeros(count, dtype=np.int64)
+    seen = [{work[i].tobytes()} for i in range(count)]
+    active = np.arange(count)
+    while len(active) > 0:
+        board = work[active]
+        over = (np.abs(board) >= capacity) & (board != 0)
+        # Same tests as iter_overflow: something overflows and both colours are still there
+        mixed = np.where(board[:, 0, 0] > 0, (board < 0).any(axis=(1, 2)), (board > 0).any(axis=(1, 2)))
+        going = over.any(axis=(1, 2)) & mixed
+        active = active[going]
+        if len(active) == 0:
+            break
+        new = numpy_wave(board[going], over[going])
+        work[active] = new
+        waves[active] += 1
+
+        repeating = np.zeros(len(active), dtype=bool)
+        for k, i in enumerate(active.tolist()):
+            key = new[k].tobytes()
+            if key in seen[i]:
+                repeating[k] = True # The cascade has started to repeat itself
+            else:
+                seen[i].add(key)
+        active = active[~repeating]
+
+    if isinstance(boards, np.ndarray):
+        boards[...] = work
+    else:
+        for board, final in zip(boards, work):
+            if isinstance(board, Grid):
+                np.frombuffer(board.cells, dtype=np.int8)[:] = final.ravel()
+            else:
+                for row in range(rows):
+                    board[row][:] = final[row].tolist()
+    return waves.tolist()
+
 # Performs the overflow operation on the grid and adds intermediate results to a queue.
-# grid: A 2D list representing the grid of numbers.
+# grid: A 2D list representing the grid of numbers, or a Grid.
 # a_queue: An instance of the Queue data structure.
-# Returns the number of grids added to the queue.
-def overflow(grid, a_queue):
-    numRows = len(grid)
+# deltas: If True, each wave is added as a list of (row, col, new value) for the cells it changed
+#   instead of a full copy of the grid (see apply_delta and rebuild_frames).
+# backend: Which iter_overflow backend to use.
+# Returns the number of waves added to the queue.
+def overflow(grid, a_queue, deltas=False, backend=None):
+    waves = 0
+    for delta in iter_overflow(grid, backend):
+        waves += 1
+        if deltas:
+            a_queue.enqueue(delta)
+        elif isinstance(grid, Grid):
+            a_queue.enqueue(grid.copy())
+        else:
+            a_queue.enqueue([row[:] for row in grid]) # Enqueue the updated grid
+    return waves
+
+# Applies one wave recorded by overflow(..., deltas=True) to a grid.
+# grid: A 2D list representing the grid of numbers, or a Grid.
+# delta: A list of (row, col, new value).
+def apply_delta(grid, delta):
+    if isinstance(grid, Grid):
+        for row, col, value in delta:
+            grid.set(row, col, value)
+    else:
+        for row, col, value in delta:
+            grid[row][col] = value
+
+# Rebuilds the full grids of a cascade from its deltas, for callers that want snapshots.
+# grid: The grid as it was before the cascade (a 2D list or a Grid); not changed.
+# delta_queue: A Queue of deltas from overflow(..., deltas=True); it is emptied.
+# Returns a Queue holding a copy of the grid after each wave, as overflow(grid, a_queue) would.
+def rebuild_frames(grid, delta_queue):
+    frames = Queue()
+    if isinstance(grid, Grid):
+        current = grid.copy()
+    else:
+        current = [row[:] for row in grid]
+    while not delta_queue.is_empty():
+        apply_delta(current, delta_queue.dequeue())
+        frames.enqueue(current.copy() if isinstance(current, Grid) else [row[:] for row in current])
+    return frames
+
+# Function to compute the Zobrist hash of the pieces on a grid (a 2D list or a Grid)
+def board_hash(grid):
+    key = 0
+    if isinstance(grid, Grid):
+        for i, value in enumerate(grid.cells):
+            if value != 0:
+                key ^= zobrist_key(i, value)
+        return key
     numCols = len(grid[0])
+    for row in range(len(grid)):
+        for col in range(numCols):
+            if grid[row][col] != 0:
+                key ^= zobrist_key(row * numCols + col, grid[row][col])
+    return key
+
+# Class to remember how moves turned out, so a position-plus-move that was resolved before costs
+# one lookup instead of a whole cascade. Entries are kept in a partc.HashTable keyed by
+# (board hash, rows, cols, row, col, player); two boards sharing a 64-bit hash are not told apart,
+# the same trade-off the search's transposition table makes.
+# At most max_entries results are kept. When the cache is full the CLOCK policy picks the entry
+# to drop: the entries sit on a ring, a hit marks its entry, and the hand sweeps the ring
+# clearing marks until it finds an unmarked entry, so entries used since the last sweep stay.
+# It is a standalone utility for callers that replay the same moves on list or Grid boards (see
+# bench.py cache). The search, MCTS playouts and game.py do not use it: their cascades rarely
+# repeat (0-29% hits when tried inside partd.SearchBoard), and a hit would still have to update
+# the board's hash, piece counts and scores cell by cell, which costs more than the cascade
+class OverflowCache:
+    class Entry:
+        def __init__(self, cells, waves):
+            self.cells = cells  # Every cell of the final board, row by row, as an array('b')
+            self.waves = waves  # Number of overflow waves on the way there
+            self.referenced = False  # Set by a hit, cleared as the clock hand passes
+
+    def __init__(self, max_entries=1 << 12):
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.table = HashTable()
+        self.ring = []  # Keys in the order the clock hand visits them
+        self.hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    overflow_list = get_overflow_list(grid)
+    # Adds a piece of player at (row, col) of the grid and resolves the overflow in place.
+    # grid: A 2D list representing the grid of numbers, or a Grid.
+    # key: The board_hash of the grid before the move, if the caller already has it.
+    # Returns the number of overflow waves, as overflow would.
+    def play(self, grid, row, col, player, key=None):
+        is_grid = isinstance(grid, Grid)
+        if is_grid:
+            rows, cols = grid.rows(), grid.cols()
+        else:
+            rows, cols = len(grid), len(grid[0])
+        if key is None:
+            key = board_hash(grid)
+        key = (key, rows, cols, row, col, player)
 
-    def perform_overflow():
-        # Sets up and performs the overflow operation on the grid.
-        sign = 0
-        
-        for row, col in overflow_list:
-            if grid[row][col] > 0:
-                sign = 1
+        entry = self.table.search(key)
+        if entry is not None:
+            self.hits += 1
+            entry.referenced = True
+            if is_grid:
+                grid.cells[:] = entry.cells
             else:
-                sign = -1
-            grid[row][col] = sign # Mark the cell with the sign of the overflow
-        
-        new_grid = [row[:] for row in grid]  # Create a copy of the current grid
-        for row, col in overflow_list:
-            new_grid[row][col] = 0 # Set the overflowing cell to 0
-        
-        for row, col in overflow_list:
-            if col > 0:
-                if new_grid[row][col - 1] * grid[row][col] < 0: 
-                    new_grid[row][col - 1] *= -1 # Adjust the sign of the left neighbour
-                new_grid[row][col - 1] += grid[row][col]
-            if col < numCols - 1:
-                if new_grid[row][col + 1] * grid[row][col] < 0: 
-                    new_grid[row][col + 1] *= -1 # Adjust the sign of the right neighbour
-                new_grid[row][col + 1] += grid[row][col]
-            if row > 0:
-                if new_grid[row - 1][col] * grid[row][col] < 0: 
-                    new_grid[row - 1][col] *= -1 # Adjust the sign of the upper neighbour
-                new_grid[row - 1][col] += grid[row][col]
-            if row < numRows - 1:
-                if new_grid[row + 1][col] * grid[row][col] < 0: 
-                    new_grid[row + 1][col] *= -1 # Adjust the sign of the lower neighbour
-                new_grid[row + 1][col] += grid[row][col]
-
-        for row in range(len(grid)):
-            for col in range(len(grid[0])):
-                grid[row][col] = new_grid[row][col] # Update the original grid with the new values
-        return 1
-
-    if overflow_list is not None:
-        overflow_status = check_sign_overflow_status(grid)
-        if overflow_status:
-            count = perform_overflow()
-            a_queue.enqueue([row[:] for row in grid])  # Enqueue the updated grid
-            return count + overflow(grid, a_queue) # Recursively call overflow
-    return 0
\ No newline at end of file
+                for r in range(rows):
+                    grid[r][:] = entry.cells[r * cols:(r + 1) * cols].tolist()
+            return entry.waves
+
+        self.misses += 1
+        if is_grid:
+            grid.set(row, col, grid.get(row, col) + player)
+        else:
+            grid[row][col] += player
+        waves = sum(1 for _ in iter_overflow(grid))
+        if is_grid:
+            cells = grid.cells[:]
+        else:
+            cells = array('b', [value for r in grid for value in r])
+        self.store(key, self.Entry(cells, waves))
+        return waves
+
+    # Adds an entry, making room with the clock hand when the cache is full
+    def store(self, key, entry):
+        if len(self.ring) < self.max_entries:
+            self.ring.append(key)
+        else:
+            while True:
+                old = self.table.search(self.ring[self.hand])
+                if not old.referenced:
+                    break
+                old.referenced = False
+                self.hand = (self.hand + 1) % self.max_entries
+            self.table.remove(self.ring[self.hand])
+            self.evictions += 1
+            self.ring[self.hand] = key
+            self.hand = (self.hand + 1) % self.max_entries
+        self.table.insert(key, entry)
+
+    # Returns the fraction of moves that were found in the cache (0 before any move)
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    # Returns the hit and miss counts as a dict
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hit_rate()}
+
+    def __len__(self):
+        return len(self.table)
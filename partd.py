@@ -1,3 +1,36 @@
+import itertools
+import json
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from grid import Grid, SIDE_KEY, zobrist_key
+from partb import spread
+from partc import HashTable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Function to compute the Zobrist hash of a board with the given player to move
+def hash_board(board, player):
+    width = len(board[0])
+    key = SIDE_KEY if player == -1 else 0
+    for row in range(len(board)):
+        for col in range(width):
+            if board[row][col] != 0:
+                key ^= zobrist_key(row * width + col, board[row][col])
+    return key
+
 # Function to create a deep copy of the board
 def copy_board(board):
     current_board = []
@@ -22,43 +55,763 @@ def evaluate_board(board, player):
                 score -= 1  # Subtract score for opponent's pieces
     return score 
 
+# Function to score many boards of the same size for the given player in one go
+# boards: A list of boards, or a NumPy array of boards x rows x cols
+# Returns a list with the evaluate_board score of each board. With numpy installed the whole
+# block is scored by a few array comparisons instead of a Python loop per cell
+def evaluate_boards(boards, player):
+    if np is None:
+        return [evaluate_board(board, player) for board in boards]
+    if len(boards) == 0:
+        return []
+    block = np.asarray(boards)
+    own = np.count_nonzero(block == player, axis=(1, 2))
+    other = np.count_nonzero(block == -player, axis=(1, 2))
+    wins = np.count_nonzero(block == 4 * player, axis=(1, 2))
+    return (100 * player * wins + own - other).tolist()
+
+# Class to cache search results for positions, keyed by Zobrist hash
+# The table holds at most max_entries positions: each hash maps to one slot of a partc.HashTable
+# and the replacement policy decides who keeps a slot when two positions collide
+#   - "depth": keep the entry searched to the greater depth (ties go to the newer entry)
+#   - "always": the newer entry always replaces the older one
+# Values are scored for one player, so a table should only be shared by searches for that player
+class TranspositionTable:
+    EXACT = 0  # value is the exact minimax value
+    LOWER = 1  # value is a lower bound (the search failed high)
+    UPPER = 2  # value is an upper bound (the search failed low)
+
+    class Entry:
+        def __init__(self, key, depth, flag, value, move, generation):
+            self.key = key  # Full hash, to detect two positions sharing a slot
+            self.depth = depth  # Remaining depth the value was searched to
+            self.flag = flag  # EXACT, LOWER or UPPER
+            self.value = value
+            self.move = move  # Best move found, or None
+            self.generation = generation  # Search that stored the entry
+
+    def __init__(self, max_entries=1 << 16, replacement="depth"):
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+        if replacement not in ("depth", "always"):
+            raise ValueError("replacement must be 'depth' or 'always'")
+        self.max_entries = max_entries
+        self.replacement = replacement
+        # The HashTable is only storage for the slots: a hash picks its slot as key % max_entries,
+        # which is what bounds the table, and the full key in each entry tells positions apart
+        self.table = HashTable()
+        self.probes = 0  # Number of lookups
+        self.hits = 0  # Number of lookups that found the position
+        self.generation = 0  # Bumped by new_search when the table is kept for another move
+        self.id = next(_shared_ids)  # Names the table's stand-ins in the worker processes
+
+    # Function to start a new search on a table kept from earlier moves
+    # Entries from earlier searches stay usable but always give up their slot to new ones
+    def new_search(self):
+        self.generation += 1
+
+    # Returns the entry stored for the hash, or None if the position is not in the table
+    def probe(self, key):
+        self.probes += 1
+        entry = self.table.search(key % self.max_entries)
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        return None
+
+    # Stores a search result, subject to the replacement policy
+    def store(self, key, depth, flag, value, move):
+        slot = key % self.max_entries
+        entry = self.table.search(slot)
+        if entry is None:
+            self.table.insert(slot, self.Entry(key, depth, flag, value, move, self.generation))
+        elif (entry.key == key or self.replacement == "always" or depth >= entry.depth
+              or entry.generation != self.generation):
+            self.table.modify(slot, self.Entry(key, depth, flag, value, move, self.generation))
+
+    # Returns the fraction of lookups that found the position (0 before any lookup)
+    def hit_rate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    def __len__(self):
+        return len(self.table)
+
+# Class to count what a GameTree search does: how well it prunes, how much it looks at and how long
+# it takes, for finding out why a move was slow and for tracking the search over time
+class SearchStats:
+    def __init__(self):
+        self.expanded = 0  # Positions whose moves were searched
+        self.cutoffs = 0  # Positions where a move caused a cut-off
+        self.first_move_cutoffs = 0  # Cut-offs caused by the first move tried
+        self.generated = 0  # Positions generated: moves played by the lazy search, nodes of the eager tree
+        self.evaluated = 0  # Positions scored by the evaluation
+        self.seconds = 0.0  # Time get_move took
+        self.depth = 0  # Deepest iteration that finished
+        self.plies = []  # (depth, positions generated, seconds) for each iteration that finished
+        self.table_probes = 0  # Transposition table lookups made by this search
+        self.table_hits = 0
+        self.peak_memory = None  # Peak resident memory of the process in bytes, if it can be read
+
+    # Function to add counters (expanded, cutoffs, first_move_cutoffs, evaluated, table_probes,
+    # table_hits) from another search
+    def add_counters(self, counters):
+        self.expanded += counters[0]
+        self.cutoffs += counters[1]
+        self.first_move_cutoffs += counters[2]
+        self.evaluated += counters[3]
+        self.table_probes += counters[4]
+        self.table_hits += counters[5]
+
+    # Returns the counters add_counters takes
+    def counters(self):
+        return (self.expanded, self.cutoffs, self.first_move_cutoffs, self.evaluated, self.table_probes,
+                self.table_hits)
+
+    # Function to fill in the time taken and the peak memory once the search is over
+    def finish(self, seconds):
+        self.seconds = seconds
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS bytes
+            self.peak_memory = peak if sys.platform == "darwin" else peak * 1024
+
+    # Returns the positions generated per second (0 before any time has passed)
+    def nodes_per_second(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.generated / self.seconds
+
+    # Returns the effective branching factor: the number b with b ** depth positions generated by
+    # the deepest iteration (0 before any iteration finished)
+    def branching_factor(self):
+        if not self.plies:
+            return 0.0
+        depth, nodes, seconds = self.plies[-1]
+        if depth == 0 or nodes == 0:
+            return 0.0
+        return nodes ** (1 / depth)
+
+    # Returns the fraction of table lookups that found the position (0 without lookups)
+    def table_hit_rate(self):
+        if self.table_probes == 0:
+            return 0.0
+        return self.table_hits / self.table_probes
+
+    # Returns the fraction of expanded positions that were cut off
+    def cutoff_rate(self):
+        if self.expanded == 0:
+            return 0.0
+        return self.cutoffs / self.expanded
+
+    # Returns the fraction of cut-offs that came from the first move (1.0 is perfect ordering)
+    def first_move_rate(self):
+        if self.cutoffs == 0:
+            return 0.0
+        return self.first_move_cutoffs / self.cutoffs
+
+    # Returns the counters and the rates worked out from them as a dict
+    def to_dict(self):
+        return {
+            "generated": self.generated,
+            "evaluated": self.evaluated,
+            "seconds": self.seconds,
+            "nodes_per_second": self.nodes_per_second(),
+            "depth": self.depth,
+            "branching_factor": self.branching_factor(),
+            "plies": [list(ply) for ply in self.plies],
+            "expanded": self.expanded,
+            "cutoffs": self.cutoffs,
+            "cutoff_rate": self.cutoff_rate(),
+            "first_move_rate": self.first_move_rate(),
+            "table_probes": self.table_probes,
+            "table_hit_rate": self.table_hit_rate(),
+            "peak_memory": self.peak_memory,
+        }
+
+    # Returns the stats as one line of JSON, with any extra fields (such as the move) added
+    def to_json(self, **extra):
+        record = self.to_dict()
+        record.update(extra)
+        return json.dumps(record)
+
+    # Function to append the stats as one line to the JSON lines file at path
+    def log(self, path, **extra):
+        with open(path, 'a') as f:
+            f.write(self.to_json(**extra) + "\n")
+
+# Raised inside the search when its time or node budget runs out
+class SearchAborted(Exception):
+    pass
+
+# What each cell value adds to evaluate_board for (player 1, player 2); other values add nothing
+CELL_SCORES = {1: (1, -1), -1: (-1, 1), 4: (100, 0), -4: (0, -100)}
+
+# Score of a won position under the game rules, less one per ply it takes to get there so the
+# search prefers quicker wins and slower losses; far above anything evaluate_board can return
+WIN_SCORE = 1000000
+# Deepest a budgeted search under the game rules goes without a max_depth: unlike placing on
+# empty cells, the real game does not run out of moves
+MAX_GAME_DEPTH = 64
+
+# Function to turn a score at the given ply into the score stored in a transposition table
+# A win is scored by the ply it happens at, but a position can be reached at different plies,
+# so the table keeps the distance from the position to the win instead
+def to_table(value, ply):
+    if value > WIN_SCORE // 2:
+        return value + ply
+    if value < -WIN_SCORE // 2:
+        return value - ply
+    return value
+
+# Function to turn a score stored in a transposition table back into a score at the given ply
+def from_table(value, ply):
+    if value > WIN_SCORE // 2:
+        return value - ply
+    if value < -WIN_SCORE // 2:
+        return value + ply
+    return value
+
+# Class to hold the board a search is working on, as one flat Grid that is changed in place
+# play() applies a move and records every cell it changes in an undo log, undo() rolls the
+# last move back, so the search never has to copy the board
+# rules picks the moves the search looks at:
+#   - "placement": a piece on an empty cell, with no overflow (what GameTree.Node generates)
+#   - "game": a piece on an empty cell or one of the player's own, followed by the overflow it
+#     causes, as game.Board plays it
+# With symmetry=True a hash is also kept for every mirror image and rotation of the board
+# (see table_key)
+class SearchBoard:
+    def __init__(self, board, player, rules="placement", symmetry=False):
+        if rules not in ("placement", "game"):
+            raise ValueError("rules must be 'placement' or 'game'")
+        self.rules = rules
+        self.grid = Grid.from_lists(board)
+        self.height = self.grid.rows()
+        self.width = self.grid.cols()
+        self.cells = self.grid.cells
+        self.player = player  # Player to move
+        # Neighbours of each cell and the number of pieces that make it overflow, shared by all
+        # boards of this size
+        self.neighbours = self.grid.shape.neighbours
+        self.capacity = self.grid.shape.capacity
+        self.hash = hash_board(board, player)
+        self.positive = sum(1 for value in self.cells if value > 0)  # Cells owned by player 1
+        self.negative = sum(1 for value in self.cells if value < 0)  # Cells owned by player 2
+        # Running evaluate_board scores for player 1 and player 2
+        self.score_p1 = evaluate_board(board, 1)
+        self.score_p2 = evaluate_board(board, -1)
+        self.undo_log = []  # (index, old value) for every change, most recent last
+        self.marks = []  # Length of the undo log when each move was played
+        self.symmetries = None
+        if symmetry:
+            self.symmetries = self.grid.shape.symmetries
+            # Hash of each transformed board, without the side to move
+            self.symmetry_hashes = [0] * len(self.symmetries)
+            for t, cells in enumerate(self.symmetries):
+                for index, value in enumerate(self.cells):
+                    self.symmetry_hashes[t] ^= zobrist_key(cells[index], value)
+
+    # Function to change one cell, keeping the hash, piece counts and scores up to date
+    def set_cell(self, index, value):
+        old = self.cells[index]
+        self.undo_log.append((index, old))
+        self.change(index, old, value)
+
+    # Function to replace the old value of a cell by value without logging it
+    def change(self, index, old, value):
+        self.cells[index] = value
+        self.hash ^= zobrist_key(index, old) ^ zobrist_key(index, value)
+        if self.symmetries is not None:
+            hashes = self.symmetry_hashes
+            for t, cells in enumerate(self.symmetries):
+                moved = cells[index]
+                hashes[t] ^= zobrist_key(moved, old) ^ zobrist_key(moved, value)
+        if old > 0:
+            self.positive -= 1
+        elif old < 0:
+            self.negative -= 1
+        if value > 0:
+            self.positive += 1
+        elif value < 0:
+            self.negative += 1
+        if old in CELL_SCORES:
+            self.score_p1 -= CELL_SCORES[old][0]
+            self.score_p2 -= CELL_SCORES[old][1]
+        if value in CELL_SCORES:
+            self.score_p1 += CELL_SCORES[value][0]
+            self.score_p2 += CELL_SCORES[value][1]
+
+    # Function to add a piece for the player to move at index and pass the turn
+    # With overflow=True the resulting chain reaction is resolved as well; by default it is
+    # resolved under the game rules only
+    # Returns the number of overflow waves
+    def play(self, index, overflow=None):
+        if overflow is None:
+            overflow = self.rules == "game"
+        self.marks.append(len(self.undo_log))
+        self.set_cell(index, self.cells[index] + self.player)
+        waves = self.resolve_overflow() if overflow else 0
+        self.player = -self.player
+        self.hash ^= SIDE_KEY
+        return waves
+
+    # Function to take back the last move played, including any overflow it caused
+    def undo(self):
+        mark = self.marks.pop()
+        while len(self.undo_log) > mark:
+            index, old = self.undo_log.pop()
+            self.change(index, self.cells[index], old)
+        self.player = -self.player
+        self.hash ^= SIDE_KEY
+
+    # Function to tell if overflow keeps going, using the same test as partb.check_sign_overflow_status
+    # (the sign of the top left cell, counting an empty cell as negative, against every other cell)
+    def mixed_signs(self):
+        if self.cells[0] > 0:
+            return self.negative > 0
+        return self.positive > 0
+
+    # Function to resolve overflow in place, wave by wave, with the rules of partb.overflow
+    # Pieces are never created, so a cascade either settles or runs into a board it has already
+    # been through; it then repeats forever, so it is stopped on that board instead
+    # Returns the number of waves
+    def resolve_overflow(self):
+        cells = self.cells
+        capacity = self.capacity
+        waves = 0
+        seen = {self.hash}
+        candidates = range(len(cells))  # Only cells the last wave touched can overflow next
+        while True:
+            overflow_list = sorted(i for i in candidates if cells[i] != 0 and abs(cells[i]) >= capacity[i])
+            if not overflow_list or not self.mixed_signs():
+                return waves
+            changes = spread(cells, self.neighbours, overflow_list)
+            for i, value in changes.items():
+                if cells[i] != value:
+                    self.set_cell(i, value)
+            waves += 1
+            if self.hash in seen:
+                return waves  # The cascade has started to repeat itself
+            seen.add(self.hash)
+            candidates = changes
+
+    # Function to get the key to look the position up by in a transposition table
+    # Returns (key, symmetry): without symmetry, the hash and None; with it, the smallest hash
+    # over all the mirror images and rotations, so they all share one entry, and the index of
+    # the transform giving it (moves are stored as cells of that transformed board)
+    def table_key(self):
+        if self.symmetries is None:
+            return self.hash, None
+        hashes = self.symmetry_hashes
+        t = min(range(len(hashes)), key=hashes.__getitem__)
+        return hashes[t] ^ (SIDE_KEY if self.player == -1 else 0), t
+
+    # Function to tell who has won: the only player left with pieces on the board, or 0
+    # (the test game.Board.check_win makes once the game has started)
+    def winner(self):
+        if self.positive == 0:
+            return -1
+        if self.negative == 0:
+            return 1
+        return 0
+
+    # Generator over the moves for the player to move: the indexes of the empty cells, and under
+    # the game rules the player's own cells too (game.Board.valid_move)
+    # If first is one of them, it is yielded before all the others
+    def moves(self, first=None):
+        cells = self.cells
+        player = self.player if self.rules == "game" else 0  # 0: own cells are not moves
+        if first is not None and (cells[first] == 0 or cells[first] * player > 0):
+            yield first
+        else:
+            first = None
+        for index in range(len(cells)):
+            value = cells[index]
+            if (value == 0 or value * player > 0) and index != first:
+                yield index
+
+    # Function to score the board for the given player, the same way as evaluate_board
+    # The scores are kept up to date as cells change, so this does not look at the board
+    def evaluate(self, player):
+        return self.score_p1 if player == 1 else self.score_p2
+
+    # Function to convert the board back to a list of rows
+    def to_lists(self):
+        return self.grid.to_lists()
+
+# Class to prove wins and losses near the end of a game, under the game rules
+# Instead of scoring positions with evaluate_board it only asks whether the player to move can
+# force a win within a number of plies, deepening one ply at a time so the quickest win is found
+# first. Every position it proves is kept, so it is never searched again, by this solver or by
+# a GameTree given the solver (see alphabeta); positions it could not settle are kept with the
+# depth they were searched to
+# node_limit bounds the nodes of each solve, max_plies how far ahead it looks
+# At most max_entries positions are kept; once full, only positions already in the table are updated
+class EndgameSolver:
+    WIN = 1
+    LOSS = -1
+    UNKNOWN = 0
+
+    class Entry:
+        def __init__(self, result, distance, move, depth):
+            self.result = result  # WIN or LOSS for the player to move, or UNKNOWN
+            self.distance = distance  # Plies until the game is over, for WIN and LOSS
+            self.move = move  # Winning move for WIN, or None
+            self.depth = depth  # Plies searched, for UNKNOWN
+
+    def __init__(self, node_limit=20000, max_plies=7, max_entries=1 << 18):
+        self.node_limit = node_limit
+        self.max_plies = max_plies
+        self.max_entries = max_entries
+        self.table = HashTable()
+        self.nodes = 0  # Nodes of the last solve
+        self.proven = 0  # Positions proven so far
+        self.budget = None  # Budget check of the current solve
+        self.id = next(_shared_ids)  # Names the solver's stand-ins in the worker processes
+
+    # Returns the entry of a proven position (WIN or LOSS) with the given hash, or None
+    def lookup(self, key):
+        entry = self.table.search(key)
+        if entry is not None and entry.result != self.UNKNOWN:
+            return entry
+        return None
+
+    # Function to solve the position on a SearchBoard (game rules) for the player to move
+    # budget, if given, is called at every node and stops the solve by raising SearchAborted
+    # (a GameTree passes one that holds the solve to its own time, nodes and stop_event)
+    # Returns (result, distance, move) as in Entry; the board is left as it was
+    def solve(self, board, budget=None):
+        self.nodes = 0
+        self.budget = budget
+        mark = len(board.marks)
+        result = (self.UNKNOWN, 0, None)
+        try:
+            for plies in range(1, self.max_plies + 1):
+                result = self.prove(board, plies)
+                if result[0] != self.UNKNOWN:
+                    break
+        except SearchAborted:
+            while len(board.marks) > mark:
+                board.undo()
+        return result
+
+    # Function to find out if the player to move wins or loses within plies plies
+    def prove(self, board, plies):
+        self.nodes += 1
+        if self.nodes > self.node_limit:
+            raise SearchAborted()
+        if self.budget is not None:
+            self.budget()
+        winner = board.winner()
+        if winner != 0:
+            return (self.WIN if winner == board.player else self.LOSS, 0, None)
+        if plies == 0:
+            return (self.UNKNOWN, 0, None)
+        key = board.hash
+        entry = self.table.search(key)
+        if entry is not None:
+            if entry.result != self.UNKNOWN:
+                return (entry.result, entry.distance, entry.move)
+            if entry.depth >= plies:
+                return (self.UNKNOWN, 0, None)
+
+        # Moves that set off overflow are the ones that can end the game, so they go first
+        cells = board.cells
+        capacity = board.capacity
+        player = board.player
+        moves = sorted(board.moves(), key=lambda move: abs(cells[move] + player) < capacity[move])
+        lost = len(moves) > 0
+        longest = 0
+        for move in moves:
+            board.play(move)
+            result, distance, _ = self.prove(board, plies - 1)
+            board.undo()
+            if result == self.LOSS:
+                # The opponent loses whatever it does
+                self.store(key, self.Entry(self.WIN, distance + 1, move, plies))
+                return (self.WIN, distance + 1, move)
+            if result == self.UNKNOWN:
+                lost = False
+            longest = max(longest, distance + 1)
+        if lost:
+            self.store(key, self.Entry(self.LOSS, longest, None, plies))
+            return (self.LOSS, longest, None)
+        self.store(key, self.Entry(self.UNKNOWN, 0, None, plies))
+        return (self.UNKNOWN, 0, None)
+
+    # Function to keep an entry, subject to max_entries
+    def store(self, key, entry):
+        if entry.result != self.UNKNOWN:
+            self.proven += 1
+        if self.table.search(key) is not None:
+            self.table.modify(key, entry)
+        elif len(self.table) < self.max_entries:
+            self.table.insert(key, entry)
+
+    def __len__(self):
+        return len(self.table)
+
+# Most cells the eager search scores in one NumPy block, and the bytes each takes while it is
+# scored (the boards and the comparisons of evaluate_boards)
+BLOCK_CELLS = 1 << 18
+BLOCK_CELL_BYTES = 4
+
+# Class to hand out the nodes of eager GameTrees and take them back for reuse, so a new tree fills
+# the node objects and board rows of an old one instead of allocating fresh ones
+# max_nodes caps how many nodes may be in use at once, and max_bytes caps their estimated size
+# (node, board and place in its parent's children list) plus the bytes reserved by reserve; the
+# lower of the two applies. Nodes count as in use until their tree's clear_tree gives them back
+class NodePool:
+    def __init__(self, max_nodes=None, max_bytes=None):
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.reserved = 0  # Bytes of max_bytes kept back for other uses (see reserve)
+        self.free = []  # Released nodes, ready to be handed out again
+        self.in_use = 0
+        self.peak = 0  # Most nodes in use at once
+        self.created = 0
+        self.reused = 0
+
+    # Returns the estimated size in bytes of one node with a board of rows x cols
+    def node_bytes(self, rows, cols):
+        node = GameTree.Node.__new__(GameTree.Node)
+        return (sys.getsizeof(node) + sys.getsizeof([None] * rows) + rows * sys.getsizeof([0] * cols)
+                + sys.getsizeof([]) + 8)
+
+    # Function to keep nbytes of max_bytes back from the nodes, for working memory that is not
+    # nodes (reservations do not add up: the largest one is kept back)
+    def reserve(self, nbytes):
+        self.reserved = max(self.reserved, nbytes)
+
+    # Returns how many more nodes with a board of rows x cols may be handed out, or None if
+    # there is no ceiling
+    def nodes_left(self, rows, cols):
+        limit = self.max_nodes
+        if self.max_bytes is not None:
+            by_size = max(self.max_bytes - self.reserved, 0) // self.node_bytes(rows, cols)
+            limit = by_size if limit is None else min(limit, by_size)
+        if limit is None:
+            return None
+        return max(limit - self.in_use, 0)
+
+    # Returns how many levels (at most height) a tree of placements fits in the pool, below a
+    # board of rows x cols with empty empty cells, besides spare more nodes; None if not even the
+    # board's own node fits
+    # Every node on a level has one child per empty cell, so the tree's size is known in advance
+    def affordable_height(self, rows, cols, empty, height, spare=0):
+        left = self.nodes_left(rows, cols)
+        if left is None:
+            return height
+        left -= spare
+        total = 1
+        level = 1
+        if total > left:
+            return None
+        for depth in range(height):
+            level *= max(empty - depth, 0)
+            total += level
+            if total > left:
+                return depth
+        return height
+
+    # Returns a node holding a copy of board, reusing a released node when there is one
+    def acquire(self, board, depth, player):
+        if self.free:
+            node = self.free.pop()
+            if len(node.board) == len(board) and len(node.board[0]) == len(board[0]):
+                for row, values in zip(node.board, board):
+                    row[:] = values
+            else:
+                node.board = copy_board(board)
+            node.depth = depth
+            node.player = player
+            self.reused += 1
+        else:
+            node = GameTree.Node(board, depth, player, depth)
+            self.created += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        return node
+
+    # Function to take back a node and everything below it
+    def release(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children)
+            node.children.clear()
+            self.free.append(node)
+            self.in_use -= 1
+
 # Class to represent the game tree for AI decision-making
 class GameTree:
     
     # Inner class to represent each node in the game tree
+    # __slots__ keeps each node to its four fields, without a per-node __dict__
     class Node:
-        def __init__(self, board, depth, player, tree_height=4):
+        __slots__ = ('board', 'depth', 'player', 'children')
+
+        def __init__(self, board, depth, player, tree_height=4, pool=None):
             self.board = copy_board(board)  # Copy of the board at this node
             self.depth = depth  # Depth of the node in the tree
             self.player = player  # Player to move at this node
             self.children = []  # List of child nodes (possible moves)
             # Generate children if the current depth is less than the tree height
             if depth < tree_height:
-                self.generate_children(tree_height)
+                self.generate_children(tree_height, pool)
 
         # Function to generate child nodes (possible moves)
-        def generate_children(self, tree_height):
+        # With a NodePool the children are taken from the pool instead of being created
+        def generate_children(self, tree_height, pool=None):
             height = len(self.board)
             width = len(self.board[0])
             # Iterate over each cell in the board
             for row in range(height):
                 for col in range(width):
                     if self.board[row][col] == 0:  # Check if the cell is empty
-                        new_board = copy_board(self.board)  # Copy the board
-                        new_board[row][col] = self.player  # Place the player's piece
-                        # Add the new board configuration as a child node
-                        self.children.append(GameTree.Node(new_board, self.depth + 1, -self.player, tree_height))
+                        if pool is None:
+                            new_board = copy_board(self.board)  # Copy the board
+                            new_board[row][col] = self.player  # Place the player's piece
+                            # Add the new board configuration as a child node
+                            self.children.append(GameTree.Node(new_board, self.depth + 1, -self.player, tree_height))
+                            continue
+                        child = pool.acquire(self.board, self.depth + 1, -self.player)
+                        child.board[row][col] = self.player
+                        if child.depth < tree_height:
+                            child.generate_children(tree_height, pool)
+                        self.children.append(child)
 
     # Initialize the game tree with the current board, player, and desired tree height
-    def __init__(self, board, player, tree_height=4):
+    # With lazy=True the tree is not built up front: get_move runs an alpha-beta search that
+    # plays and takes back moves on a single SearchBoard, and returns the same move as minimax would
+    # A TranspositionTable passed as table lets the lazy search reuse results for positions
+    # reached through different move orders
+    # Giving time_limit (seconds) or node_limit makes the lazy search deepen iteratively from
+    # depth 1 to max_depth and return the best move of the deepest iteration that finished
+    # (without a max_depth, a budgeted search keeps deepening until the budget runs out or
+    # every empty cell is filled)
+    # With workers > 1 the root moves of the lazy search are split across that many processes
+    # pv is a line of moves (cell indexes) expected from this position, tried first
+    # Setting stop_event (a threading.Event) stops the lazy search as if its budget had run out
+    # ordering=False keeps plain board order (after the PV and table move)
+    # rules="game" makes the lazy search play the real game (see SearchBoard): pieces also go on
+    # the player's own cells, overflow is resolved after every move, a player left without pieces
+    # has lost, and get_move returns the cell actually played rather than what find_move reports
+    # quiescence_nodes > 0 (game rules only) lets every leaf of the lazy search spend up to that many
+    # nodes following moves that set off overflow before it is scored (see quiesce)
+    # symmetry=True makes mirror images and rotations of a position share their transposition
+    # table entry. Only the placement rules allow it: under the game rules the cell an overflow
+    # leaves a piece's colour in depends on row-major order, and whether a cascade goes on
+    # depends on the top left cell, so a mirrored position can play out differently
+    # An EndgameSolver passed as solver (game rules only) is tried first whenever the player has at
+    # most endgame_moves moves, and a win it proves is played at once; positions it has proven are
+    # scored as won or lost by the search without going below them
+    # With numpy installed (and batch left on) minimax scores all the leaves under a node in one
+    # evaluate_boards call instead of one evaluate_board call per leaf
+    # The eager tree's nodes come from pool (a NodePool, by default one of its own) and go back to
+    # it in clear_tree. The pool's ceiling is never passed: if the whole tree does not fit, get_move
+    # builds, scores and gives back the root's children one at a time, each with as many levels
+    # below it as fit (the blocks of batch scoring need none). If not even the root and one child
+    # fit, get_move runs the lazy search instead, which holds no nodes. tree_height says how deep
+    # minimax looks
+    def __init__(self, board, player, tree_height=4, lazy=False, table=None,
+                 time_limit=None, node_limit=None, max_depth=None, workers=1, pv=None, stop_event=None,
+                 ordering=True, rules="placement", quiescence_nodes=0, symmetry=False, solver=None,
+                 endgame_moves=0, batch=True, pool=None):
+        if rules == "game" and not lazy:
+            raise ValueError("the game rules are only searched lazily")
+        if symmetry and rules == "game":
+            raise ValueError("positions are only symmetric under the placement rules")
+        if solver is not None and rules != "game":
+            raise ValueError("the endgame solver needs the game rules")
+        self.solver = solver
+        self.endgame_moves = endgame_moves
+        self.endgame = None  # What the solver found for the root, if it was tried
+        self.batch = batch and np is not None  # Score the leaves of the eager tree in blocks
+        self.symmetry = symmetry
         self.player = player  # Player who will make the move
-        self.root = self.Node(board, 0, player, tree_height)  # Root node of the tree
+        self.lazy = lazy
+        self.rules = rules
+        self.table = table
+        self.workers = workers  # Processes sharing the root moves of the lazy search
+        self.search_id = None  # Id of this search on the process pool
+        self.stop_event = stop_event
+        self.ordering = ordering  # Order moves with killer moves and the history table
+        self.stats = SearchStats()
+        self.killers = []  # Up to two moves per ply that caused a cut-off
+        self.history = []  # Per cell: how much cut-offs the move there has caused
+        # minimax never scores below depth 3, so the fourth level of the tree is never needed
+        self.search_depth = min(tree_height, 3)
+        if max_depth is None:
+            if lazy and (time_limit is not None or node_limit is not None):
+                if rules == "game":
+                    max_depth = MAX_GAME_DEPTH
+                else:
+                    max_depth = sum(1 for row in board for value in row if value == 0)
+            else:
+                max_depth = self.search_depth
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.start_time = None
+        self.partial_index = None  # Best move so far in an unfinished first iteration
+        self.nodes = 0  # Number of nodes visited by the lazy search
+        self.quiescence_nodes = quiescence_nodes if rules == "game" else 0
+        self.quiescence_left = 0  # Nodes the current leaf may still spend on quiescence
+        self.qnodes = 0  # Number of those nodes visited by quiesce (also counted in nodes)
+        self.pv = [] if pv is None else pv  # Principal variation (cell indexes) of the last finished iteration
+        self.pv_table = []
+        self.completed_depth = 0  # Deepest iteration that finished
+        if lazy:
+            self.board = SearchBoard(board, player, rules, symmetry)
+            self.root = None
+        else:
+            self.pool = NodePool() if pool is None else pool
+            rows = len(board)
+            cols = len(board[0])
+            empty = sum(1 for row in board for value in row if value == 0)
+            self.block_cells = BLOCK_CELLS  # Most cells scored in one block
+            if self.batch and self.pool.max_bytes is not None:
+                # The blocks get at most a quarter of the ceiling, held back from the nodes
+                self.block_cells = max(min(BLOCK_CELLS, self.pool.max_bytes // (4 * BLOCK_CELL_BYTES)), rows * cols)
+                self.pool.reserve(self.block_cells * BLOCK_CELL_BYTES)
+            # Build no deeper than minimax looks, and only as deep as the pool allows. Scoring in
+            # blocks only needs the root's children: the blocks are built from their boards
+            wanted = min(self.search_depth, 1) if self.batch else self.search_depth
+            height = self.pool.affordable_height(rows, cols, empty, wanted)
+            self.child_height = None  # Levels below each root child, if they are built one at a time
+            self.fallback = None  # Lazy search standing in when not even one child fits
+            self.root = None
+            if height == wanted:
+                self.tree_height = self.search_depth if self.batch else height
+                handed_out = self.pool.created + self.pool.reused
+                self.root = self.pool.acquire(board, 0, player)  # Root node of the tree
+                if height > 0:
+                    self.root.generate_children(height, self.pool)
+                self.stats.generated = self.pool.created + self.pool.reused - handed_out
+            else:
+                below = None
+                if wanted > 0:
+                    below = self.pool.affordable_height(rows, cols, empty - 1, wanted - 1, spare=1)
+                if below is None:
+                    self.tree_height = self.search_depth
+                    self.fallback = GameTree(board, player, self.search_depth, lazy=True)
+                else:
+                    self.tree_height = self.search_depth if self.batch else below + 1
+                    self.child_height = below
+                    self.root = self.pool.acquire(board, 0, player)
+                    self.stats.generated = 1
 
     # Minimax algorithm to evaluate the best possible move
     def minimax(self, node, maximizing_player):
         # Base case: if the node has no children or reaches a terminal depth
-        if len(node.children) == 0 or node.depth == 3:
+        if node.depth >= self.tree_height or (len(node.children) == 0 and not self.batch):
+            self.stats.evaluated += 1
             return evaluate_board(node.board, self.player)
+        if self.batch:
+            return self.minimax_block(node.board, node.player, self.tree_height - node.depth, maximizing_player)
 
         if maximizing_player:
             max_eval = float('-inf')  # Initialize max evaluation score
@@ -74,28 +827,683 @@ class GameTree:
                 min_eval = min(min_eval, eval)  # Choose the minimum score
             return min_eval
 
+    # Function to get the minimax value of board, with player to move, levels moves deep, scoring
+    # all the leaves in one evaluate_boards call, without building nodes for them
+    # Every position on a level has as many moves as its siblings (one per empty cell), so the
+    # leaves form a block with one axis per level, built from the board alone by placing one
+    # piece per level on every empty cell in row-major order (the order generate_children uses).
+    # minimax is then a max or min over each axis, from the deepest level up
+    # A block of more than block_cells cells is split up: by the first move while more than one
+    # level is left, then into runs of leaves
+    def minimax_block(self, board, player, levels, maximizing_player):
+        parent = np.array(board, dtype=np.int8)
+        rows, cols = np.nonzero(parent == 0)
+        levels = min(levels, len(rows))  # A full board ends the game
+        leaves = 1
+        for level in range(levels):
+            leaves *= len(rows) - level
+        if leaves * parent.size > self.block_cells:
+            values = []
+            if levels > 1:
+                for row, col in zip(rows.tolist(), cols.tolist()):
+                    child = parent.copy()
+                    child[row, col] = player
+                    values.append(self.minimax_block(child, -player, levels - 1, not maximizing_player))
+            else:
+                run = max(self.block_cells // parent.size, 1)
+                for start in range(0, len(rows), run):
+                    count = len(rows[start:start + run])
+                    block = np.repeat(parent[np.newaxis], count, axis=0)
+                    block[np.arange(count), rows[start:start + run], cols[start:start + run]] = player
+                    self.stats.evaluated += count
+                    values.extend(evaluate_boards(block, self.player))
+            return max(values) if maximizing_player else min(values)
+        block = parent[np.newaxis]
+        shape = []
+        for _ in range(levels):
+            boards, rows, cols = np.nonzero(block == 0)
+            shape.append(len(rows) // len(block))
+            block = np.repeat(block, shape[-1], axis=0)
+            block[np.arange(len(rows)), rows, cols] = player
+            player = -player
+        self.stats.evaluated += len(block)
+        scores = np.array(evaluate_boards(block, self.player)).reshape(shape)
+        for level in reversed(range(levels)):
+            if maximizing_player == (level % 2 == 0):
+                scores = scores.max(axis=-1)
+            else:
+                scores = scores.min(axis=-1)
+        return int(scores)
+
+    # Minimax with alpha-beta pruning, playing and taking back moves on the search board
+    # Returns the minimax value whenever it lies strictly between alpha and beta,
+    # otherwise a bound on it that is outside the window (fail-soft)
+    # on_pv is True while the position lies on the previous iteration's principal variation
+    def alphabeta(self, ply, alpha, beta, maximizing_player, on_pv=False):
+        self.check_budget()
+        board = self.board
+        self.pv_table[ply] = []
+        if board.rules == "game":
+            winner = board.winner()
+            if winner != 0:
+                # The game is over, whatever depth is left
+                return WIN_SCORE - ply if winner == self.player else ply - WIN_SCORE
+            if self.solver is not None:
+                solved = self.solver.lookup(board.hash)
+                if solved is not None:
+                    winner = board.player if solved.result == EndgameSolver.WIN else -board.player
+                    end = ply + solved.distance
+                    return WIN_SCORE - end if winner == self.player else end - WIN_SCORE
+        depth = self.search_depth - ply  # Remaining depth below this position
+        table_move = None
+        # A leaf costs about as much to score as to look up, so only inner positions use the table
+        use_table = self.table is not None and depth > 0
+        if use_table:
+            key, symmetry = board.table_key()
+            entry = self.table.probe(key)
+            if entry is not None:
+                if entry.depth >= depth:
+                    stored = from_table(entry.value, ply)
+                    if entry.flag == TranspositionTable.EXACT:
+                        return stored
+                    if entry.flag == TranspositionTable.LOWER and stored >= beta:
+                        return stored
+                    if entry.flag == TranspositionTable.UPPER and stored <= alpha:
+                        return stored
+                table_move = entry.move
+                if symmetry is not None and table_move is not None:
+                    table_move = board.grid.shape.inverses[symmetry][table_move]
+        alpha_orig = alpha
+        beta_orig = beta
+        # The principal variation move is tried first, then the table move
+        pv_move = self.pv[ply] if on_pv and ply < len(self.pv) else None
+        first = table_move if pv_move is None else pv_move
+
+        best_move = None
+        if depth <= 0:
+            pass  # Leaf: scored below
+        else:
+            self.stats.expanded += 1
+            value = float('-inf') if maximizing_player else float('inf')
+            searched = 0
+            for move in self.ordered_moves(ply, first):
+                self.nodes += 1
+                searched += 1
+                board.play(move)
+                score = self.alphabeta(ply + 1, alpha, beta, not maximizing_player, move == pv_move)
+                board.undo()
+                if maximizing_player:
+                    if score > value:
+                        value = score
+                        best_move = move
+                        self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if value >= beta:
+                        # The minimizing player will never allow this position
+                        self.record_cutoff(ply, move, depth, searched)
+                        break
+                    alpha = max(alpha, value)
+                else:
+                    if score < value:
+                        value = score
+                        best_move = move
+                        self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if value <= alpha:
+                        # The maximizing player already has a better option
+                        self.record_cutoff(ply, move, depth, searched)
+                        break
+                    beta = min(beta, value)
+
+        # A board with no empty cells is scored as a leaf, like minimax does
+        leaf = depth <= 0 or best_move is None
+        if leaf:
+            if depth <= 0 and self.quiescence_nodes > 0:
+                self.quiescence_left = self.quiescence_nodes
+                value = self.quiesce(ply, alpha, beta, maximizing_player)
+            else:
+                self.stats.evaluated += 1
+                value = board.evaluate(self.player)
+
+        if use_table:
+            if leaf:
+                flag = TranspositionTable.EXACT
+            elif value <= alpha_orig:
+                flag = TranspositionTable.UPPER
+            elif value >= beta_orig:
+                flag = TranspositionTable.LOWER
+            else:
+                flag = TranspositionTable.EXACT
+            if symmetry is not None and best_move is not None:
+                best_move = board.symmetries[symmetry][best_move]
+            self.table.store(key, depth, flag, to_table(value, ply), best_move)
+        return value
+
+    # Quiescence search below a leaf: a position one move away from a chain reaction is not
+    # scored as it stands, instead only the moves that make their cell overflow are searched
+    # further, until the position is quiet. The player to move may also stop (stand pat) and
+    # take the score as it is, so the result is never worse for them than the plain evaluation
+    # Each leaf gets quiescence_nodes nodes; once they are spent, positions are scored as they stand
+    # Returns a fail-soft alpha-beta value like alphabeta
+    def quiesce(self, ply, alpha, beta, maximizing_player):
+        board = self.board
+        winner = board.winner()
+        if winner != 0:
+            return WIN_SCORE - ply if winner == self.player else ply - WIN_SCORE
+        self.stats.evaluated += 1
+        value = board.evaluate(self.player)  # Standing pat
+        if maximizing_player:
+            if value >= beta:
+                return value
+            alpha = max(alpha, value)
+        else:
+            if value <= alpha:
+                return value
+            beta = min(beta, value)
+        cells = board.cells
+        capacity = board.capacity
+        player = board.player
+        for move in list(board.moves()):
+            if abs(cells[move] + player) < capacity[move]:
+                continue  # Quiet move
+            if self.quiescence_left <= 0:
+                break
+            self.quiescence_left -= 1
+            self.check_budget()
+            self.nodes += 1
+            self.qnodes += 1
+            board.play(move)
+            score = self.quiesce(ply + 1, alpha, beta, not maximizing_player)
+            board.undo()
+            if maximizing_player:
+                value = max(value, score)
+                if value >= beta:
+                    break
+                alpha = max(alpha, value)
+            else:
+                value = min(value, score)
+                if value <= alpha:
+                    break
+                beta = min(beta, value)
+        return value
+
+    # Function to list the moves of the current position, best candidates first:
+    # the principal variation or table move, then moves that make their cell overflow,
+    # then the killer moves of this ply, then the rest by history score (ties in board order)
+    def ordered_moves(self, ply, first):
+        board = self.board
+        moves = list(board.moves())
+        if not self.ordering:
+            if first in moves:
+                moves.remove(first)
+                moves.insert(0, first)
+            return moves
+        cells = board.cells
+        capacity = board.capacity
+        player = board.player
+        killers = self.killers[ply]
+        history = self.history
+
+        def priority(move):
+            if move == first:
+                return (3, 0)
+            if abs(cells[move] + player) >= capacity[move]:
+                return (2, history[move])
+            if move in killers:
+                return (1, history[move])
+            return (0, history[move])
+        moves.sort(key=priority, reverse=True)  # The sort is stable, so ties keep board order
+        return moves
+
+    # Function to record a cut-off: update the counters, and remember a quiet (non-overflow)
+    # move as a killer for this ply and in the history table
+    def record_cutoff(self, ply, move, depth, searched):
+        self.stats.cutoffs += 1
+        if searched == 1:
+            self.stats.first_move_cutoffs += 1
+        board = self.board
+        if abs(board.cells[move] + board.player) >= board.capacity[move]:
+            return
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        self.history[move] += depth * depth
+
+    # Function to find the position reported as the move for a child board
+    # (the first cell holding the highest value for the current player)
+    def find_move(self, board):
+        max_row_index = 0
+        max_col_index = 0
+        max_val = float('-inf')
+        for i in range(len(board)):
+            for j in range(len(board[0])):
+                if board[i][j] * self.player > max_val:
+                    max_val = board[i][j] * self.player
+                    max_row_index = i
+                    max_col_index = j
+        return (max_row_index, max_col_index)
+
+    # Function to find the position reported as the move for playing at index on the search board,
+    # matching find_move on the child board (under the game rules, the cell itself)
+    def report_move(self, index):
+        board = self.board
+        if board.rules == "game":
+            return divmod(index, board.width)
+        board.play(index)
+        best = max(range(len(board.cells)), key=lambda i: board.cells[i] * self.player)
+        board.undo()
+        return divmod(best, board.width)
+
     # Function to get the best move for the current player
+    # What the search did is left in self.stats
     def get_move(self):
+        start = time.perf_counter()
+        probes = hits = 0
+        if self.table is not None:
+            probes = self.table.probes
+            hits = self.table.hits
+        if self.lazy:
+            move = self.get_move_lazy()
+            self.stats.generated = self.nodes
+            self.stats.depth = self.completed_depth
+        else:
+            move = self.get_move_eager()
+            self.stats.depth = self.tree_height
+            self.stats.plies = [(self.tree_height, self.stats.generated, time.perf_counter() - start)]
+        if self.table is not None:
+            self.stats.table_probes += self.table.probes - probes
+            self.stats.table_hits += self.table.hits - hits
+        self.stats.finish(time.perf_counter() - start)
+        return move
+
+    # Eager version of get_move: every child of the root is scored with minimax on the built tree
+    def get_move_eager(self):
+        if self.fallback is not None:
+            move = self.fallback.get_move()
+            self.stats = self.fallback.stats
+            return move
         best_move = None
         best_score = float('-inf')  # Initialize the best score
         # Iterate over all possible moves
-        for child in self.root.children:
+        for child in self.root_children():
             score = self.minimax(child, False)  # Evaluate the move using minimax
             if score > best_score:  # Check if this move is better
                 best_score = score
-                max_row_index = 0
-                max_col_index = 0
-                max_val = float('-inf')
-                # Find the position of the move in the board
-                for i in range(len(child.board)):
-                    for j in range(len(child.board[0])):
-                        if child.board[i][j] * self.player > max_val:
-                            max_val = child.board[i][j] * self.player
-                            max_row_index = i
-                            max_col_index = j
-                best_move = (max_row_index, max_col_index)  # Save the best move
+                best_move = self.find_move(child.board)  # Save the best move
         return best_move
 
+    # Function to go through the children of the root: the built ones, or when the tree did not
+    # fit, each child built with child_height levels below it in turn and given back once scored
+    def root_children(self):
+        if self.child_height is None:
+            yield from self.root.children
+            return
+        root = self.root
+        pool = self.pool
+        for row in range(len(root.board)):
+            for col in range(len(root.board[0])):
+                if root.board[row][col] == 0:
+                    handed_out = pool.created + pool.reused
+                    child = pool.acquire(root.board, 1, -root.player)
+                    child.board[row][col] = root.player
+                    if self.child_height > 0:
+                        child.generate_children(self.child_height + 1, pool)
+                    self.stats.generated += pool.created + pool.reused - handed_out
+                    yield child
+                    pool.release(child)
+
+    # Function to stop the search once its time or node budget is used up
+    # share is the fraction of the time and nodes that may be used up
+    def check_budget(self, share=1):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit * share:
+            raise SearchAborted()
+        # Reading the clock is slow compared to a node, so only do it every 64 nodes
+        if self.time_limit is not None and self.nodes % 64 == 0:
+            if time.perf_counter() - self.start_time >= self.time_limit * share:
+                raise SearchAborted()
+
+    # Budget check for the endgame solver: its nodes count as the search's, and it may use up to
+    # half of the time and nodes, so a search after an unsettled solve still has the rest
+    def check_solver_budget(self):
+        self.nodes += 1
+        self.check_budget(0.5)
+
+    # Lazy version of get_move: the root children are scored with alpha-beta instead of minimax
+    # Only children scoring strictly higher than the best so far can replace it, so the window
+    # (best_score, inf) keeps the same choice as get_move while pruning everything else
+    # With a time or node budget the search is repeated at increasing depths, each iteration
+    # trying the previous principal variation first
+    def get_move_lazy(self):
+        self.start_time = time.perf_counter()
+        if self.table is not None:
+            self.table.new_search()
+        self.pv_table = [[] for _ in range(self.max_depth + 2)]
+        self.killers = [[] for _ in range(self.max_depth + 2)]
+        self.history = [0] * len(self.board.cells)
+        if self.solver is not None and sum(1 for _ in self.board.moves()) <= self.endgame_moves:
+            self.endgame = self.solver.solve(self.board, self.check_solver_budget)
+            if self.endgame[0] == EndgameSolver.WIN:
+                self.pv = [self.endgame[2]]
+                return divmod(self.endgame[2], self.board.width)
+        if self.time_limit is None and self.node_limit is None:
+            depths = [self.max_depth]
+        else:
+            depths = range(1, self.max_depth + 1)
+
+        best_move = None
+        self.partial_index = None
+        for depth in depths:
+            self.search_depth = depth
+            if self.time_limit is not None and time.perf_counter() - self.start_time >= self.time_limit:
+                break
+            nodes = self.nodes
+            started = time.perf_counter()
+            try:
+                move = self.search_root()
+            except SearchAborted:
+                # Take back the moves the search was in the middle of
+                while self.board.marks:
+                    self.board.undo()
+                break
+            best_move = move
+            self.pv = self.pv_table[0]
+            self.completed_depth = depth
+            self.stats.plies.append((depth, self.nodes - nodes, time.perf_counter() - started))
+
+        if best_move is None and self.partial_index is not None:
+            # Not even the first iteration finished: use the best move found so far
+            best_move = self.report_move(self.partial_index)
+        if best_move is None:
+            for move in self.board.moves():
+                best_move = self.report_move(move)
+                break
+        return best_move
+
+    # Function to predict the position the player will face next, from the principal variation
+    # Returns (hash of the board after our move and the expected reply, rest of the variation),
+    # or None if the variation is too short to say
+    def expected_position(self):
+        if len(self.pv) < 3:
+            return None
+        board = self.board
+        board.play(self.pv[0])
+        board.play(self.pv[1])
+        key = board.hash
+        board.undo()
+        board.undo()
+        return key, self.pv[2:]
+
+    # Function to search every root move to the current search depth
+    # Moves are tried in principal variation order, but ties still go to the first move in
+    # row-major order: a move before the current best is searched with the window lowered by one
+    # so that an equal (integer) score is returned exactly
+    def search_root(self):
+        if self.workers > 1:
+            return self.search_root_parallel()
+        board = self.board
+        pv_move = self.pv[0] if self.pv else None
+        best_score = float('-inf')
+        best_index = None
+        for move in self.ordered_moves(0, pv_move):
+            self.nodes += 1
+            alpha = best_score
+            if best_index is not None and move < best_index:
+                alpha = best_score - 1
+            board.play(move)
+            score = self.alphabeta(1, alpha, float('inf'), False, move == pv_move)
+            board.undo()
+            if score > best_score or (score == best_score and move < best_index):
+                best_score = score
+                best_index = move
+                self.pv_table[0] = [move] + self.pv_table[1]
+                self.partial_index = move
+        if best_index is None:
+            return None
+        return self.report_move(best_index)
+
+    # Function to search every root move to the current search depth on a process pool
+    # Each root move is one task. Tasks of one search share the best score found so far in a slot
+    # of the pool of their own, and a move is searched with alpha one below it, so every move that
+    # could be chosen still gets its exact score and the pick is the same as search_root's
+    # The tasks share the deadline and nodes left when the iteration starts, and stop_event. Each
+    # worker keeps a table (and solver) standing in for this search's, from one move to the next
+    def search_root_parallel(self):
+        self.check_budget()  # Tasks only see stop_event once they are running
+        board = self.board
+        pv_move = self.pv[0] if self.pv else None
+        pool, bests, stops, slots = get_pool(self.workers)
+        if self.search_id is None:
+            self.search_id = next(_search_ids)
+        deadline = None
+        if self.time_limit is not None:
+            # Worker processes have clocks of their own, so the deadline is given in wall-clock time
+            deadline = time.time() + self.time_limit - (time.perf_counter() - self.start_time)
+        moves = list(board.moves(pv_move))  # The PV move goes first to set a good bound early
+        nodes_left = None
+        if self.node_limit is not None:
+            nodes_left = max((self.node_limit - self.nodes) // max(len(moves), 1), 1)
+        table = None
+        if self.table is not None:
+            table = (self.table.id, self.table.max_entries, self.table.replacement)
+        solver = None
+        if self.solver is not None:
+            solver = (self.solver.id, self.solver.node_limit, self.solver.max_plies, self.solver.max_entries,
+                      self.endgame_moves)
+
+        slot = slots.get()  # Waits while every slot is taken by other searches
+        try:
+            bests[slot] = float('-inf')
+            stops[slot] = 0
+            futures = []
+            for move in moves:
+                pv = self.pv if move == pv_move else []
+                futures.append(pool.submit(search_root_move, self.search_id, slot, board.to_lists(), self.player,
+                                           move, self.search_depth, pv, deadline, nodes_left, self.rules,
+                                           self.quiescence_nodes, self.symmetry, table, solver))
+            # Wait for the tasks, stopping the rest once one runs out of budget or stop_event is set
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=None if self.stop_event is None else 0.01,
+                                     return_when=FIRST_COMPLETED)
+                stopped = self.stop_event is not None and self.stop_event.is_set()
+                if stopped or any(future.result() is None for future in done):
+                    stops[slot] = 1
+            results = [future.result() for future in futures]
+        finally:
+            slots.put(slot)
+        if any(result is None for result in results):
+            raise SearchAborted()
+
+        best_score = float('-inf')
+        best_index = None
+        for move, score, nodes, pv, counters in results:
+            self.nodes += nodes + 1
+            self.stats.add_counters(counters)
+            if score > best_score or (score == best_score and move < best_index):
+                best_score = score
+                best_index = move
+                self.pv_table[0] = [move] + pv
+        if best_index is None:
+            return None
+        return self.report_move(best_index)
+
+    # Function to score one root move for a worker process (see search_root_move)
+    # bests is the shared array of best scores so far, and slot the one of this search
+    # With a solver and the opponent down to endgame_moves moves, the position after the move is
+    # solved first, like get_move_lazy does for the root
+    # Returns the score and the principal variation below the move
+    def score_root_move(self, move, pv, bests=None, slot=None):
+        self.start_time = time.perf_counter()
+        self.pv_table = [[] for _ in range(self.max_depth + 2)]
+        self.killers = [[] for _ in range(self.max_depth + 2)]
+        self.history = [0] * len(self.board.cells)
+        self.search_depth = self.max_depth
+        self.pv = pv
+        alpha = float('-inf')
+        if bests is not None:
+            alpha = bests[slot] - 1
+        self.board.play(move)
+        if self.solver is not None and sum(1 for _ in self.board.moves()) <= self.endgame_moves:
+            self.solver.solve(self.board, self.check_solver_budget)
+        score = self.alphabeta(1, alpha, float('inf'), False, bool(pv) and move == pv[0])
+        self.board.undo()
+        if bests is not None:
+            with bests.get_lock():
+                if score > bests[slot]:
+                    bests[slot] = score
+        return score, self.pv_table[1]
+
     # Function to clear the game tree (freeing memory)
     def clear_tree(self):
+        if self.root is not None and not self.lazy:
+            self.pool.release(self.root)  # Hand the nodes back for the next tree
         self.root = None  # Set the root to None to delete the tree
+
+
+# Class to ponder: search the opponent's likely replies in a background thread while they think
+# search is a function (board, stop_event) that runs the bot's own search for a position and
+# returns its result; results are kept by the hash of the position they were searched for
+class Ponderer:
+    def __init__(self, search):
+        self.search = search
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.results = {}  # Hash of a position (bot to move) -> result of search
+
+    # Function to start pondering after the bot played move (a cell index) on board
+    # The predicted reply, if given, is searched first, then every other reply in board order
+    def start(self, board, move, player, predicted=None):
+        self.stop()
+        self.results = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       args=(copy_board(board), move, player, predicted, self.stop_event))
+        self.thread.start()
+
+    # Body of the background thread
+    # The opponent's replies are whatever the game allows, whichever rules the bot searches with
+    def run(self, board, move, player, predicted, stop_event):
+        search_board = SearchBoard(board, player, "game")
+        search_board.play(move)
+        if search_board.winner() != 0:
+            return  # The game is over
+        for reply in list(search_board.moves(predicted)):
+            if stop_event.is_set():
+                return
+            search_board.play(reply)
+            position = search_board.to_lists()
+            key = search_board.hash
+            search_board.undo()
+            result = self.search(position, stop_event)
+            if stop_event.is_set():
+                return  # Cut short, so the result is not a full search
+            self.results[key] = result
+
+    # Function to stop pondering and wait for the background thread to finish
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Returns the pondered result for the position with the given hash, or None
+    def take(self, key):
+        return self.results.get(key)
+
+# Process pools for parallel root search, one per worker count, kept for the life of the program
+_pools = {}
+# Searches that may use one pool at the same time, each with a slot of its own
+POOL_SLOTS = 8
+# Best root score so far and stop flag of each slot, shared with the worker processes of a pool
+# (set in each worker)
+_shared_bests = None
+_shared_stops = None
+# Tables and solvers of a worker process, by the id of the table or solver they stand in for,
+# with the search that last used each table; only the most recently used few are kept
+WORKER_KEEP = 4
+_worker_tables = {}
+_worker_solvers = {}
+# Source of ids telling the searches sent to the pools apart
+_search_ids = itertools.count()
+# Source of ids telling tables and solvers apart
+_shared_ids = itertools.count()
+
+# Class to let a worker's search see the stop flag of its slot as if it were a threading.Event
+class SharedFlag:
+    def __init__(self, flags, slot):
+        self.flags = flags
+        self.slot = slot
+
+    def is_set(self):
+        return self.flags[self.slot] != 0
+
+# Function to set up a worker process with the pool's shared best scores and stop flags
+def init_worker(shared_bests, shared_stops):
+    global _shared_bests, _shared_stops
+    _shared_bests = shared_bests
+    _shared_stops = shared_stops
+
+# Function to get the process pool with the given number of workers, its shared best scores and
+# stop flags, and the queue of free slots
+def get_pool(workers):
+    if workers not in _pools:
+        bests = multiprocessing.Array('d', POOL_SLOTS)
+        stops = multiprocessing.RawArray('b', POOL_SLOTS)  # Only ever set, so reads need no lock
+        slots = queue.Queue()
+        for slot in range(POOL_SLOTS):
+            slots.put(slot)
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(bests, stops))
+        _pools[workers] = (pool, bests, stops, slots)
+    return _pools[workers]
+
+# Function to get the worker's stand-in for a table or solver, made by new() the first time
+def worker_state(states, key, new):
+    state = states.pop(key, None)
+    if state is None:
+        state = new()
+        while len(states) >= WORKER_KEEP:
+            del states[next(iter(states))]  # The least recently used
+    states[key] = state
+    return state
+
+# Task run by a worker process: scores playing move on board for player to the given depth
+# deadline is in time.time() seconds; table is (id, max_entries, replacement) and solver
+# (id, node_limit, max_plies, max_entries, endgame_moves) of the search's own, or None
+# Returns (move, score, nodes, principal variation below the move, SearchStats counters),
+# or None if the budget ran out or the search was stopped
+def search_root_move(search_id, slot, board, player, move, depth, pv, deadline, node_limit, rules="placement",
+                     quiescence_nodes=0, symmetry=False, table=None, solver=None):
+    time_limit = None
+    if deadline is not None:
+        time_limit = deadline - time.time()
+        if time_limit <= 0:
+            return None
+    worker_table = None
+    if table is not None:
+        key, max_entries, replacement = table
+        state = worker_state(_worker_tables, key, lambda: [TranspositionTable(max_entries, replacement), None])
+        worker_table = state[0]
+        if state[1] != search_id:
+            worker_table.new_search()
+            state[1] = search_id
+    worker_solver = None
+    endgame_moves = 0
+    if solver is not None:
+        key, solver_nodes, max_plies, max_entries, endgame_moves = solver
+        worker_solver = worker_state(_worker_solvers, key, lambda: EndgameSolver(solver_nodes, max_plies, max_entries))
+    tree = GameTree(board, player, lazy=True, table=worker_table,
+                    time_limit=time_limit, node_limit=node_limit, max_depth=depth, rules=rules,
+                    stop_event=SharedFlag(_shared_stops, slot), quiescence_nodes=quiescence_nodes,
+                    symmetry=symmetry, solver=worker_solver, endgame_moves=endgame_moves)
+    if worker_table is not None:
+        probes = worker_table.probes
+        hits = worker_table.hits
+    try:
+        score, below = tree.score_root_move(move, pv, _shared_bests, slot)
+    except SearchAborted:
+        return None
+    if worker_table is not None:
+        tree.stats.table_probes = worker_table.probes - probes
+        tree.stats.table_hits = worker_table.hits - hits
+    return move, score, tree.nodes, below, tree.stats.counters()
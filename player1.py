@@ -1,14 +1,7 @@
-from partd import GameTree
+from bot import Bot
 
-class PlayerOne:
+class PlayerOne(Bot):
 
-    def __init__(self, name = "P1 Bot"):
-        self.name = name
-        
-    def get_name(self):
-        return self.name
-
-    def get_play(self, board):
-        tree = GameTree(board, 1)
-        (row,col) = tree.get_move()
-        return (row,col)
\ No newline at end of file
+    # Takes the same options as bot.Bot
+    def __init__(self, name = "P1 Bot", **options):
+        Bot.__init__(self, 1, name, **options)
@@ -1,6 +1,52 @@
 
+import json
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
-from partd import evaluate_board, GameTree
+from parta import Queue
+from grid import Grid, get_shape
+import partb
+from partb import (apply_delta, check_sign_overflow_status, get_overflow_list, iter_overflow, overflow,
+                   overflow_batch, rebuild_frames, OverflowCache)
+from partd import evaluate_board, evaluate_boards, hash_board, EndgameSolver, GameTree, NodePool, SearchBoard, TranspositionTable, WIN_SCORE
+from book import OpeningBook, build_book, start_board, write_book
+from mcts import MCTS
+from player1 import PlayerOne
+from player2 import PlayerTwo
+
+def random_board(rng, height, width, fill):
+    # builds a board with roughly fill of its cells holding pieces of either player
+    # every cell stays below the number of pieces that would make it overflow,
+    # as it does between moves of a real game
+    board = [[0] * width for _ in range(height)]
+    for row in range(height):
+        for col in range(width):
+            capacity = (row > 0) + (row < height - 1) + (col > 0) + (col < width - 1)
+            if rng.random() < fill and capacity > 1:
+                board[row][col] = rng.randint(1, capacity - 1) * rng.choice([1, -1])
+    return board
+
+def game_value(board, to_move, player, depth, ply):
+    # plain minimax over the real game: pieces go on empty or own cells and overflow is resolved
+    moves = [(row, col) for row in range(len(board)) for col in range(len(board[0]))
+             if board[row][col] * to_move >= 0]
+    if depth == 0 or not moves:
+        return evaluate_board(board, player)
+    values = []
+    for row, col in moves:
+        child = [r[:] for r in board]
+        child[row][col] += to_move
+        overflow(child, Queue())
+        if not any(v > 0 for r in child for v in r):
+            values.append(WIN_SCORE - ply - 1 if player == -1 else ply + 1 - WIN_SCORE)
+        elif not any(v < 0 for r in child for v in r):
+            values.append(WIN_SCORE - ply - 1 if player == 1 else ply + 1 - WIN_SCORE)
+        else:
+            values.append(game_value(child, -to_move, player, depth - 1, ply + 1))
+    return max(values) if to_move == player else min(values)
 
 class A2BTestCase(unittest.TestCase):
     """These are the test cases for functions and classes of a2"""
@@ -128,6 +174,785 @@ class A2BTestCase(unittest.TestCase):
         self.assertNotEqual((row,col), (4,0))
         self.assertNotEqual((row,col), (4,5))
 
+    def test_lazy_gametree(self):
+        # the lazy alpha-beta search must pick exactly the move minimax picks
+        rng = random.Random(2)
+        for i in range(40):
+            board = random_board(rng, 3 + i % 3, 4, 0.5)
+            for player in (1, -1):
+                eager = GameTree(board, player)
+                lazy = GameTree(board, player, lazy=True)
+                self.assertEqual(lazy.get_move(), eager.get_move())
+
+        board = random_board(random.Random(5), 4, 5, 0.3)
+        lazy = GameTree(board, 1, lazy=True)
+        lazy.get_move()
+        empty = sum(row.count(0) for row in board)
+        full_tree = empty + empty * (empty - 1) + empty * (empty - 1) * (empty - 2)
+        self.assertLess(lazy.nodes, full_tree // 4)
+
+    def test_transposition_table(self):
+        rng = random.Random(3)
+        for i in range(30):
+            board = random_board(rng, 3 + i % 3, 4, 0.4)
+            for player in (1, -1):
+                eager = GameTree(board, player)
+                table = TranspositionTable(64 + i)
+                cached = GameTree(board, player, lazy=True, table=table)
+                self.assertEqual(cached.get_move(), eager.get_move())
+                self.assertLessEqual(len(table), 64 + i)
+
+        # the same position reached by different move orders shares one hash
+        board = random_board(rng, 4, 5, 0.3)
+        board[0][0], board[1][1], board[2][2] = 0, 0, 0
+        first = SearchBoard(board, 1)
+        for index in (0, 6, 12):
+            first.play(index)
+        second = SearchBoard(board, 1)
+        for index in (12, 6, 0):
+            second.play(index)
+        self.assertEqual(first.cells, second.cells)
+        self.assertEqual(first.hash, second.hash)
+        self.assertEqual(first.hash, hash_board(first.to_lists(), first.player))
+
+        # on a deeper search the table saves nodes, not just returns the same move
+        with_table = 0
+        without_table = 0
+        for i in range(6):
+            board = random_board(rng, 4, 5, 0.5)
+            table = TranspositionTable()
+            cached = GameTree(board, 1, lazy=True, table=table, node_limit=10 ** 7, max_depth=5)
+            plain = GameTree(board, 1, lazy=True, node_limit=10 ** 7, max_depth=5)
+            self.assertEqual(cached.get_move(), plain.get_move())
+            with_table += cached.nodes
+            without_table += plain.nodes
+            self.assertGreater(table.hits, 0)
+            self.assertLessEqual(table.hits, table.probes)
+            self.assertEqual(table.hit_rate(), table.hits / table.probes)
+        self.assertLess(with_table, without_table)
+
+        table = TranspositionTable(1)
+        self.assertEqual(table.hit_rate(), 0.0)
+        table.store(1, 3, TranspositionTable.EXACT, 5, (0, 0))
+        table.store(2, 1, TranspositionTable.EXACT, 7, (0, 1))
+        self.assertEqual(table.probe(1).value, 5)  # deeper entry is kept
+        self.assertIsNone(table.probe(2))
+        table = TranspositionTable(1, "always")
+        table.store(1, 3, TranspositionTable.EXACT, 5, (0, 0))
+        table.store(2, 1, TranspositionTable.EXACT, 7, (0, 1))
+        self.assertIsNone(table.probe(1))
+        self.assertEqual(table.probe(2).move, (0, 1))
+
+    def test_iterative_deepening(self):
+        rng = random.Random(4)
+        for i in range(20):
+            board = random_board(rng, 4, 4 + i % 2, 0.4)
+            for player in (1, -1):
+                fixed = GameTree(board, player, lazy=True)
+                deepening = GameTree(board, player, lazy=True, table=TranspositionTable(),
+                                     node_limit=10 ** 6, max_depth=3)
+                self.assertEqual(deepening.get_move(), fixed.get_move())
+                self.assertEqual(deepening.completed_depth, 3)
+                self.assertEqual(len(deepening.pv), 3)
+
+        # with a budget and no max_depth the search goes past the usual three plies
+        board = random_board(rng, 3, 3, 0.6)
+        board[0][0] = 0
+        empty = sum(row.count(0) for row in board)
+        tree = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 6)
+        tree.get_move()
+        self.assertEqual(tree.completed_depth, empty)
+        board = random_board(rng, 5, 6, 0.3)
+        tree = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=20000)
+        tree.get_move()
+        self.assertGreater(tree.completed_depth, 3)
+
+        # running out of budget still returns a legal move from a shallower iteration
+        board = random_board(rng, 5, 6, 0.2)
+        tree = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=200, max_depth=6)
+        (row, col) = tree.get_move()
+        self.assertLess(tree.completed_depth, 6)
+        self.assertGreaterEqual(board[row][col], 0)
+        tree = GameTree(board, -1, lazy=True, time_limit=0.0, max_depth=6)
+        (row, col) = tree.get_move()
+        self.assertEqual(tree.completed_depth, 0)
+        self.assertLessEqual(board[row][col], 0)
+
+    def test_move_ordering(self):
+        rng = random.Random(11)
+        for i in range(10):
+            board = random_board(rng, 4, 5, 0.4)
+            plain = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 6,
+                             max_depth=4, ordering=False)
+            ordered = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 6, max_depth=4)
+            self.assertEqual(ordered.get_move(), plain.get_move())
+            self.assertGreater(ordered.stats.cutoffs, 0)
+            self.assertLessEqual(ordered.stats.cutoffs, ordered.stats.expanded)
+            self.assertTrue(0 < ordered.stats.cutoff_rate() <= 1)
+            self.assertTrue(0 < ordered.stats.first_move_rate() <= 1)
+
+        # table move, then overflowing moves, then killers, then history
+        tree = GameTree([[0, 0, 0, 0]], 1, lazy=True)
+        tree.killers = [[2]]
+        tree.history = [0, 5, 0, 9]
+        self.assertEqual(tree.ordered_moves(0, 1), [1, 3, 0, 2])
+        tree = GameTree([[0, 0, 0], [0, 0, 0]], 1, lazy=True)
+        tree.killers = [[4]]
+        tree.history = [0, 1, 0, 7, 0, 2]
+        self.assertEqual(tree.ordered_moves(0, 2), [2, 4, 3, 5, 1, 0])
+
+    def test_search_reuse(self):
+        # after the expected reply, a search that keeps the table and line of play does less work
+        rng = random.Random(8)
+        reused = 0
+        fresh = 0
+        for i in range(4):
+            board = random_board(rng, 5, 6, 0.4)
+            table = TranspositionTable()
+            first = GameTree(board, 1, lazy=True, table=table, node_limit=10 ** 7, max_depth=5)
+            first.get_move()
+            key, line = first.expected_position()
+            search_board = SearchBoard(board, 1)
+            search_board.play(first.pv[0])
+            search_board.play(first.pv[1])
+            board = search_board.to_lists()
+
+            second = GameTree(board, 1, lazy=True, table=table, node_limit=10 ** 7, max_depth=5, pv=line)
+            self.assertEqual(second.board.hash, key)
+            again = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 7, max_depth=5)
+            self.assertEqual(second.get_move(), again.get_move())
+            reused += second.nodes
+            fresh += again.nodes
+        self.assertLess(reused, fresh)
+
+        bot = PlayerOne(node_limit=5000)
+        bot.get_play(random_board(rng, 5, 6, 0.3))
+        self.assertGreater(len(bot.table), 0)
+        self.assertIsNotNone(bot.expected)
+
+        # PlayerTwo is the same bot playing for -1
+        board = random_board(rng, 5, 6, 0.3)
+        two = PlayerTwo(node_limit=5000, reuse=False)
+        self.assertEqual(two.get_name(), "P2 Bot")
+        expected = GameTree(board, -1, lazy=True, table=TranspositionTable(), node_limit=5000).get_move()
+        self.assertEqual(two.get_play(board), expected)
+
+    def test_pondering(self):
+        rng = random.Random(10)
+        board = random_board(rng, 4, 5, 0.4)
+        board[0][0], board[3][4] = 1, -1
+        bot = PlayerOne(reuse=False, ponder=True)
+        (row, col) = bot.get_play(board)
+        bot.ponderer.thread.join()  # let it ponder every reply
+
+        search_board = SearchBoard(board, 1)
+        search_board.play(row * 5 + col, overflow=True)
+        reply = next(search_board.moves())
+        search_board.play(reply, overflow=True)
+        position = search_board.to_lists()
+        pondered = bot.ponderer.take(search_board.hash)
+        self.assertIsNotNone(pondered)
+        self.assertEqual(pondered[0], PlayerOne(reuse=False).get_play(position))
+        self.assertEqual(bot.get_play(position), pondered[0])
+
+        # a reply that was not pondered is searched normally
+        bot.ponderer.stop()
+        bot.ponderer.results = {}
+        self.assertEqual(bot.get_play(position), pondered[0])
+        bot.ponderer.stop()
+
+    def test_parallel_root_search(self):
+        rng = random.Random(7)
+        for i in range(6):
+            board = random_board(rng, 4, 5, 0.4)
+            for player in (1, -1):
+                serial = GameTree(board, player, lazy=True, max_depth=3)
+                parallel = GameTree(board, player, lazy=True, max_depth=3, workers=2)
+                self.assertEqual(parallel.get_move(), serial.get_move())
+                self.assertEqual(len(parallel.pv_table[0]), 3)
+        board = random_board(rng, 4, 5, 0.4)
+        serial = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 6, max_depth=4)
+        parallel = GameTree(board, 1, lazy=True, table=TranspositionTable(), node_limit=10 ** 6, max_depth=4,
+                            workers=2)
+        self.assertEqual(parallel.get_move(), serial.get_move())
+        self.assertEqual(parallel.completed_depth, 4)
+        self.assertGreater(parallel.stats.table_probes, 0)
+
+        # two searches sharing the pool at once keep their bounds apart
+        boards = [random_board(rng, 4, 5, 0.4) for _ in range(6)]
+        expected = [GameTree(board, 1, lazy=True, max_depth=3).get_move() for board in boards]
+        results = {}
+        def search(name):
+            results[name] = [GameTree(board, 1, lazy=True, max_depth=3, workers=2).get_move() for board in boards]
+        threads = [threading.Thread(target=search, args=(name,)) for name in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {0: expected, 1: expected})
+
+        # the time limit holds for the whole search, and a stopped search returns at once
+        board = random_board(rng, 5, 6, 0.3)
+        start = time.perf_counter()
+        GameTree(board, 1, lazy=True, time_limit=0.2, workers=2).get_move()
+        self.assertLess(time.perf_counter() - start, 0.4)
+        stop_event = threading.Event()
+        stop_event.set()
+        tree = GameTree(board, 1, lazy=True, node_limit=10 ** 9, workers=2, stop_event=stop_event)
+        self.assertIsNotNone(tree.get_move())
+        self.assertEqual(tree.completed_depth, 0)
+
+    def test_grid(self):
+        board = [[1, 0, -2], [0, 3, 0]]
+        grid = Grid.from_lists(board)
+        self.assertEqual(grid.to_lists(), board)
+        self.assertEqual(grid.get(1, 1), 3)
+        self.assertIs(grid.shape, get_shape(2, 3))
+        self.assertEqual(list(grid.shape.capacity), [2, 3, 2, 2, 3, 2])
+        self.assertEqual(grid.shape.neighbours[4], (1, 3, 5))
+        copy = grid.copy()
+        copy.set(0, 1, -1)
+        self.assertEqual(grid.get(0, 1), 0)
+        self.assertNotEqual(copy, grid)
+
+        # overflow on a Grid goes through the same waves as on a list of rows
+        rng = random.Random(12)
+        for i in range(100):
+            board = random_board(rng, 2 + i % 4, 2 + i % 5, 0.8)
+            row = rng.randrange(len(board))
+            col = rng.randrange(len(board[0]))
+            player = 1 if board[row][col] >= 0 else -1
+            board[row][col] += player
+            grid = Grid.from_lists(board)
+            self.assertEqual(get_overflow_list(grid), get_overflow_list(board))
+            self.assertEqual(check_sign_overflow_status(grid), check_sign_overflow_status(board))
+            list_waves = Queue()
+            grid_waves = Queue()
+            self.assertEqual(overflow(grid, grid_waves), overflow(board, list_waves))
+            while not list_waves.is_empty():
+                self.assertEqual(grid_waves.dequeue().to_lists(), list_waves.dequeue())
+            self.assertTrue(grid_waves.is_empty())
+
+    def test_overflow_waves(self):
+        waves = Queue()
+        self.assertEqual(overflow([[0, 2, 1, 1, 1, -1]], waves), 4)
+        self.assertEqual(waves.dequeue(), [[1, 0, 2, 1, -2, 0]])
+        self.assertEqual(waves.dequeue(), [[0, 2, 0, -3, 0, -1]])
+        self.assertEqual(waves.dequeue(), [[1, 0, -2, 0, -2, 0]])
+        self.assertEqual(waves.dequeue(), [[0, -2, 0, -2, 0, -1]])
+        self.assertTrue(waves.is_empty())
+
+        # the generator works out one wave per step, updating the board in place
+        board = [[0, 2, 1, 1, 1, -1]]
+        waves = iter_overflow(board)
+        self.assertEqual(board, [[0, 2, 1, 1, 1, -1]])
+        self.assertEqual(next(waves), [(0, 1, 0), (0, 5, 0), (0, 0, 1), (0, 2, 2), (0, 4, -2)])
+        self.assertEqual(board, [[1, 0, 2, 1, -2, 0]])
+        self.assertEqual(len(list(waves)), 3)
+        self.assertEqual(board, [[0, -2, 0, -2, 0, -1]])
+
+        # a chain reaction longer than the recursion limit
+        board = [[0, 2] + [1] * 2997 + [-1]]
+        self.assertEqual(overflow(board, Queue()), 2998)
+        self.assertEqual(board[0][:4], [0, -2, 0, -2])
+
+        # deltas hold only the changed cells and rebuild the same frames
+        deltas = Queue()
+        self.assertEqual(overflow([[0, 2, 1, 1, 1, -1]], deltas, deltas=True), 4)
+        self.assertEqual(deltas.get_front(), [(0, 1, 0), (0, 5, 0), (0, 0, 1), (0, 2, 2), (0, 4, -2)])
+        rng = random.Random(3)
+        for i in range(100):
+            board = random_board(rng, 2 + i % 4, 3 + i % 3, 0.8)
+            board[i % len(board)][0] = 3 if board[i % len(board)][0] >= 0 else -3
+            start = [row[:] for row in board]
+            frames = Queue()
+            deltas = Queue()
+            self.assertEqual(overflow(Grid.from_lists(board), deltas, deltas=True), overflow(board, frames))
+            rebuilt = rebuild_frames(start, deltas)
+            self.assertTrue(deltas.is_empty())
+            self.assertEqual(len(rebuilt), len(frames))
+            while not frames.is_empty():
+                frame = rebuilt.dequeue()
+                self.assertEqual(frame, frames.dequeue())
+            apply_delta(start, [(0, 0, 5)])
+            self.assertEqual(start[0][0], 5)
+
+    @unittest.skipIf(partb.np is None, "numpy is not installed")
+    def test_overflow_numpy(self):
+        # the NumPy backend goes through exactly the same waves as the Python one
+        rng = random.Random(8)
+        for i in range(200):
+            board = random_board(rng, 1 + i % 7, 1 + i % 6, 0.8)
+            row = rng.randrange(len(board))
+            col = rng.randrange(len(board[0]))
+            board[row][col] += 1 if board[row][col] >= 0 else -1
+            for start in ([row[:] for row in board], Grid.from_lists(board)):
+                expected = Queue()
+                frames = Queue()
+                python_grid = start.copy() if isinstance(start, Grid) else [row[:] for row in start]
+                self.assertEqual(overflow(start, frames, backend="numpy"),
+                                 overflow(python_grid, expected, backend="python"))
+                while not expected.is_empty():
+                    self.assertEqual(frames.dequeue(), expected.dequeue())
+                self.assertEqual(start, python_grid)
+        self.assertRaises(ValueError, iter_overflow, [[1]], "fortran")
+
+    def test_overflow_batch(self):
+        # a batch ends on the same boards, after the same number of waves, as one board at a time
+        rng = random.Random(9)
+        boards = []
+        for i in range(100):
+            board = random_board(rng, 4, 5, 0.8)
+            board[i % 4][i % 5] += 1 if board[i % 4][i % 5] >= 0 else -1
+            boards.append(board)
+        expected = [[row[:] for row in board] for board in boards]
+        waves = [overflow(board, Queue(), backend="python") for board in expected]
+        self.assertGreater(max(waves), 1)
+        self.assertEqual(overflow_batch(boards), waves)
+        self.assertEqual(boards, expected)
+
+        grids = [Grid.from_lists(board) for board in boards]
+        self.assertEqual(overflow_batch(grids), [0] * len(grids))
+        self.assertEqual(overflow_batch([]), [])
+        if partb.np is not None:
+            stack = partb.np.array([[[0, 2, 1, 1, 1, -1]], [[0, 1, 1, 1, 1, 0]]])
+            self.assertEqual(overflow_batch(stack), [4, 0])
+            self.assertEqual(stack.tolist(), [[[0, -2, 0, -2, 0, -1]], [[0, 1, 1, 1, 1, 0]]])
+
+    def test_evaluate_boards(self):
+        # a block of boards scores the same as evaluate_board on each, for both players
+        rng = random.Random(13)
+        boards = [random_board(rng, 4, 5, 0.7) for _ in range(50)]
+        boards[0][1][1] = 4
+        boards[1][2][3] = -4
+        for player in (1, -1):
+            expected = [evaluate_board(board, player) for board in boards]
+            self.assertEqual(evaluate_boards(boards, player), expected)
+        self.assertEqual(evaluate_boards([], 1), [])
+
+        # the eager tree gets the same values and move whether or not it scores leaves in blocks
+        for height, width, fill, height_limit in ((3, 3, 0.3, 4), (4, 4, 0.5, 3), (3, 4, 0.2, 2), (2, 2, 0.7, 4)):
+            board = random_board(rng, height, width, fill)
+            for player in (1, -1):
+                single = GameTree(board, player, tree_height=height_limit, batch=False)
+                batched = GameTree(board, player, tree_height=height_limit)
+                self.assertEqual([batched.minimax(child, False) for child in batched.root.children],
+                                 [single.minimax(child, False) for child in single.root.children])
+                self.assertEqual(batched.get_move(), single.get_move())
+                if partb.np is not None:
+                    # only the root's children are built, the rest is scored from their boards
+                    empty = sum(1 for row in board for value in row if value == 0)
+                    self.assertEqual(batched.pool.in_use, 1 + empty)
+
+    def test_node_pool(self):
+        board = random_board(random.Random(14), 4, 4, 0.3)
+        empty = sum(1 for row in board for value in row if value == 0)
+        expected = GameTree(board, 1, batch=False).get_move()
+        pool = NodePool(max_nodes=1 + empty + empty * (empty - 1) + empty * (empty - 1) * (empty - 2))
+        tree = GameTree(board, 1, pool=pool, batch=False)
+        self.assertEqual(pool.in_use, pool.max_nodes)
+        self.assertEqual(tree.get_move(), expected)
+        self.assertFalse(hasattr(tree.root, '__dict__'))
+
+        # a tree that does not fit has its root's children built and scored one at a time, as
+        # deep as fits under the ceiling, which is never passed
+        pool = NodePool(max_nodes=1 + 1 + (empty - 1))
+        tree = GameTree(board, 1, pool=pool, batch=False)
+        self.assertEqual(tree.tree_height, 2)
+        self.assertEqual(tree.get_move(), GameTree(board, 1, tree_height=2, batch=False).get_move())
+        self.assertLessEqual(pool.peak, pool.max_nodes)
+        self.assertEqual(pool.in_use, 1)
+        if partb.np is not None:
+            pool = NodePool(max_nodes=2)
+            tree = GameTree(board, 1, pool=pool)
+            self.assertEqual(tree.tree_height, 3)
+            self.assertEqual(tree.get_move(), expected)
+            self.assertLessEqual(pool.peak, 2)
+
+        # without room for the root and one child the lazy search stands in
+        pool = NodePool(max_nodes=1)
+        tree = GameTree(board, 1, pool=pool)
+        self.assertEqual(tree.get_move(), expected)
+        self.assertEqual(pool.peak, 0)
+
+        # released nodes are reused by the next tree
+        pool = NodePool()
+        GameTree(board, 1, pool=pool, batch=False).clear_tree()
+        self.assertEqual(pool.in_use, 0)
+        created = pool.created
+        other = [[0] * 3 for _ in range(3)]
+        tree = GameTree(other, -1, pool=pool, batch=False)
+        self.assertEqual(pool.created, created)
+        self.assertEqual(tree.get_move(), GameTree(other, -1).get_move())
+        self.assertEqual(tree.root.board, other)
+
+    def test_search_stats(self):
+        # a deepening search records every iteration and what it looked at
+        board = start_board(4, 4)
+        table = TranspositionTable()
+        tree = GameTree(board, 1, lazy=True, table=table, node_limit=3000, rules="game", quiescence_nodes=16)
+        tree.get_move()
+        stats = tree.stats
+        self.assertEqual(stats.generated, tree.nodes)
+        self.assertEqual(stats.depth, tree.completed_depth)
+        self.assertEqual([ply[0] for ply in stats.plies], list(range(1, tree.completed_depth + 1)))
+        self.assertLessEqual(sum(ply[1] for ply in stats.plies), stats.generated)
+        self.assertGreater(stats.evaluated, 0)
+        self.assertGreater(stats.nodes_per_second(), 0)
+        self.assertGreater(stats.branching_factor(), 1)
+        self.assertEqual(stats.table_probes, table.probes)
+        self.assertTrue(0 < stats.table_hit_rate() < 1)
+        record = json.loads(stats.to_json(move=[1, 2]))
+        self.assertEqual(record["move"], [1, 2])
+        self.assertEqual(record["generated"], stats.generated)
+
+        # the eager tree counts its nodes and scored leaves
+        board = [[0, 1, 0], [0, -1, 0], [0, 0, 0]]
+        tree = GameTree(board, 1, batch=False)
+        tree.get_move()
+        self.assertEqual(tree.stats.generated, 1 + 7 + 7 * 6 + 7 * 6 * 5)
+        self.assertEqual(tree.stats.evaluated, 7 * 6 * 5)
+        self.assertEqual(tree.stats.depth, 3)
+
+        # the players keep the stats of their last search and log them as JSON lines
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.jsonl")
+            player = PlayerOne(node_limit=500, endgame_moves=0, stats_log=path)
+            player.get_play(start_board(3, 3))
+            self.assertGreater(player.last_stats.generated, 0)
+            player.get_play(start_board(3, 3))
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 2)
+            self.assertEqual(records[0]["name"], player.get_name())
+
+    def test_overflow_cache(self):
+        rng = random.Random(10)
+        cache = OverflowCache(50)
+        for i in range(200):
+            board = random_board(rng, 3, 4, 0.8)
+            row, col = i % 3, i % 4
+            player = 1 if board[row][col] >= 0 else -1
+            expected = [r[:] for r in board]
+            expected[row][col] += player
+            waves = overflow(expected, Queue())
+            for start in (board, Grid.from_lists(board)):
+                first = [r[:] for r in start] if isinstance(start, list) else start.copy()
+                self.assertEqual(cache.play(first, row, col, player), waves)
+                again = [r[:] for r in start] if isinstance(start, list) else start.copy()
+                self.assertEqual(cache.play(again, row, col, player), waves)
+                self.assertEqual(first, again)
+                self.assertEqual(again if isinstance(again, list) else again.to_lists(), expected)
+            self.assertLessEqual(len(cache), 50)
+        # lists and Grids share entries, so only the first of the four plays can miss
+        self.assertEqual(cache.hits + cache.misses, 800)
+        self.assertLessEqual(cache.misses, 200)
+        self.assertEqual(cache.stats()["evictions"], cache.misses - len(cache))
+        self.assertEqual(cache.hit_rate(), cache.hits / 800)
+
+        # an entry used since the clock hand last passed it survives the next eviction
+        cache = OverflowCache(2)
+        board = [[0, 0, 0], [0, 0, 0]]
+        cache.play([r[:] for r in board], 0, 0, 1)
+        cache.play([r[:] for r in board], 0, 1, 1)
+        cache.play([r[:] for r in board], 0, 0, 1)
+        cache.play([r[:] for r in board], 0, 2, 1)
+        cache.play([r[:] for r in board], 0, 0, 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_search_board(self):
+        rng = random.Random(6)
+        for i in range(200):
+            board = random_board(rng, 2 + i % 5, 2 + i % 4, 0.7)
+            player = rng.choice([1, -1])
+            row = rng.randrange(len(board))
+            col = rng.randrange(len(board[0]))
+            if board[row][col] * player < 0:
+                continue
+            search_board = SearchBoard(board, player)
+            before = list(search_board.cells)
+            before_hash = search_board.hash
+            search_board.play(row * len(board[0]) + col, overflow=True)
+
+            # the same move resolved by partb.overflow
+            expected = [list(r) for r in board]
+            expected[row][col] += player
+            overflow(expected, Queue())
+            self.assertEqual(search_board.to_lists(), expected)
+            self.assertEqual(search_board.hash, hash_board(expected, -player))
+            self.assertEqual(search_board.positive, sum(v > 0 for r in expected for v in r))
+            self.assertEqual(search_board.negative, sum(v < 0 for r in expected for v in r))
+            self.assertEqual(search_board.evaluate(1), evaluate_board(expected, 1))
+            self.assertEqual(search_board.evaluate(-1), evaluate_board(expected, -1))
+
+            search_board.undo()
+            self.assertEqual(list(search_board.cells), before)
+            self.assertEqual(search_board.hash, before_hash)
+            self.assertEqual(search_board.player, player)
+            self.assertEqual(search_board.undo_log, [])
+            self.assertEqual(search_board.evaluate(player), evaluate_board(board, player))
+            self.assertEqual(search_board.evaluate(-player), evaluate_board(board, -player))
+
+        # cells worth a hundred points are tracked too
+        board = [[4, -4, 1, 0], [-1, 0, 2, 0], [0, 3, -1, 0]]
+        search_board = SearchBoard(board, 1)
+        for index, player in ((3, 1), (4, -1), (7, 1)):
+            search_board.player = player
+            search_board.play(index)
+            search_board.set_cell(0, -4 * player)
+        expected = search_board.to_lists()
+        self.assertEqual(search_board.evaluate(1), evaluate_board(expected, 1))
+        self.assertEqual(search_board.evaluate(-1), evaluate_board(expected, -1))
+
+    def test_search_board_cycle(self):
+        # this cascade comes back to a board it has already been through, so it has to be cut off
+        search_board = SearchBoard([[3, 2], [-2, 2]], 1)
+        waves = search_board.play(0, overflow=True)
+        self.assertGreater(waves, 0)
+        self.assertLess(waves, 20)
+        search_board.undo()
+        self.assertEqual(search_board.to_lists(), [[3, 2], [-2, 2]])
+
+    def test_game_rules(self):
+        search_board = SearchBoard([[1, 0], [-1, 1]], 1, rules="game")
+        self.assertEqual(list(search_board.moves()), [0, 1, 3])
+        self.assertEqual(list(search_board.moves(3)), [3, 0, 1])
+        self.assertEqual(search_board.play(0), 2)  # the corner overflows and takes (1, 0)
+        self.assertEqual(search_board.to_lists(), [[1, 1], [0, 2]])
+        self.assertEqual(search_board.winner(), 1)
+        search_board.undo()
+        self.assertEqual(search_board.to_lists(), [[1, 0], [-1, 1]])
+        self.assertEqual(search_board.winner(), 0)
+        self.assertRaises(ValueError, GameTree, [[1, 0], [-1, 1]], 1, rules="game")
+
+        # the real winning move, and the cell played is the cell reported
+        board = [[0, 2, -2, 0, 0, 0],
+                 [0, 0, -3, -1, 0, 0],
+                 [0, 0, 0, 0, 0, 0],
+                 [0, 0, 0, 0, 2, 0],
+                 [0, 0, 0, 2, 0, 0]]
+        tree = GameTree(board, 1, lazy=True, rules="game")
+        move = tree.get_move()
+        child = [r[:] for r in board]
+        child[move[0]][move[1]] += 1
+        overflow(child, Queue())
+        self.assertFalse(any(v < 0 for r in child for v in r))
+
+        # the search scores every move exactly as plain minimax over the game does, with or
+        # without a transposition table
+        rng = random.Random(11)
+        for i in range(12):
+            board = random_board(rng, 3, 3 + i % 2, 0.6)
+            board[0][0], board[2][2] = 1, -1
+            for player in (1, -1):
+                scores = []
+                for index in range(len(board) * len(board[0])):
+                    row, col = divmod(index, len(board[0]))
+                    if board[row][col] * player < 0:
+                        continue
+                    child = [r[:] for r in board]
+                    child[row][col] += player
+                    overflow(child, Queue())
+                    if not any(v * -player > 0 for r in child for v in r):
+                        scores.append((WIN_SCORE - 1, -index))
+                    else:
+                        scores.append((game_value(child, -player, player, 2, 1), -index))
+                expected = divmod(-max(scores)[1], len(board[0]))
+                self.assertEqual(GameTree(board, player, lazy=True, rules="game").get_move(), expected)
+                table = TranspositionTable()
+                tree = GameTree(board, player, lazy=True, rules="game", table=table, node_limit=10 ** 6, max_depth=3)
+                self.assertEqual(tree.get_move(), expected)
+
+        # a budgeted game search is not limited by the number of empty cells
+        tree = GameTree([[1, 0], [0, -1]], 1, lazy=True, rules="game", node_limit=50)
+        self.assertGreater(tree.max_depth, 2)
+        self.assertIn(tree.get_move(), [(0, 0), (0, 1), (1, 0)])
+
+    def test_quiescence(self):
+        # one ply deep, (2, 2) looks best, but the reply it allows sets off a chain reaction;
+        # quiescence follows it and picks the move a 3 ply search picks
+        board = [[1, -2, -1, 0], [-2, -2, 0, -1], [0, -2, 2, 0]]
+        self.assertEqual(GameTree(board, 1, lazy=True, rules="game", max_depth=1).get_move(), (2, 2))
+        tree = GameTree(board, 1, lazy=True, rules="game", max_depth=1, quiescence_nodes=100)
+        self.assertEqual(tree.get_move(), (0, 0))
+        self.assertEqual(GameTree(board, 1, lazy=True, rules="game", max_depth=3).get_move(), (0, 0))
+        self.assertGreater(tree.qnodes, 0)
+
+        # every leaf spends at most its own budget
+        rng = random.Random(12)
+        for i in range(10):
+            board = random_board(rng, 4, 4, 0.7)
+            board[0][0], board[3][3] = 1, -1
+            tree = GameTree(board, 1, lazy=True, rules="game", max_depth=2, quiescence_nodes=3)
+            tree.get_move()
+            leaves = tree.nodes - tree.qnodes
+            self.assertLessEqual(tree.qnodes, 3 * leaves)
+        self.assertEqual(GameTree(board, 1, lazy=True, quiescence_nodes=3).quiescence_nodes, 0)
+
+    def test_symmetry(self):
+        rng = random.Random(13)
+        for size in ((3, 4), (4, 4)):
+            board = random_board(rng, size[0], size[1], 0.5)
+            shape = get_shape(*size)
+            key, symmetry = SearchBoard(board, -1, symmetry=True).table_key()
+            for cells in shape.symmetries:
+                flat = [value for row in board for value in row]
+                moved = [0] * len(flat)
+                for index, value in enumerate(flat):
+                    moved[cells[index]] = value
+                image = [moved[row * size[1]:(row + 1) * size[1]] for row in range(size[0])]
+                search_board = SearchBoard(image, -1, symmetry=True)
+                self.assertEqual(search_board.table_key()[0], key)
+                search_board.play(0)
+                search_board.undo()
+                self.assertEqual(search_board.table_key()[0], key)
+            self.assertEqual(len(shape.symmetries), 8 if size[0] == size[1] else 4)
+
+        # shared entries change the work done, not the moves chosen
+        for i in range(20):
+            board = random_board(rng, 3 + i % 2, 4, 0.4)
+            for player in (1, -1):
+                expected = GameTree(board, player).get_move()
+                tree = GameTree(board, player, lazy=True, table=TranspositionTable(), symmetry=True)
+                self.assertEqual(tree.get_move(), expected)
+
+        # on an empty square board a mirror image is found in the table
+        board = [[0] * 4 for _ in range(4)]
+        plain = TranspositionTable()
+        GameTree(board, 1, lazy=True, table=plain, max_depth=3).get_move()
+        folded = TranspositionTable()
+        GameTree(board, 1, lazy=True, table=folded, max_depth=3, symmetry=True).get_move()
+        self.assertLess(len(folded), len(plain))
+        self.assertGreater(folded.hits, plain.hits)
+        self.assertRaises(ValueError, GameTree, board, 1, lazy=True, rules="game", symmetry=True)
+
+    def test_opening_book(self):
+        def search(board, player):
+            return GameTree(board, player, lazy=True, rules="game", max_depth=2).get_move()
+        book = build_book(plies=1, rows=3, cols=3, search=search)
+        self.assertEqual(len(book), 1 + 8)  # the start and every first move of player 1
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "book.bin")
+            write_book(path, book, rows=3, cols=3, plies=1)
+            opening = OpeningBook(path)
+            self.assertEqual(len(opening), 9)
+            board = start_board(3, 3)
+            self.assertEqual(opening.lookup(board, 1), search(board, 1))
+            board[1][1] = 1
+            self.assertEqual(opening.lookup(board, -1), search(board, -1))
+            self.assertIsNone(opening.lookup(board, 1))  # wrong player to move
+            self.assertIsNone(opening.lookup(start_board(), 1))  # other board size
+            self.assertEqual((opening.hits, opening.misses), (2, 1))
+            opening.close()
+
+            # a bot plays the book move without searching, and searches when the book has nothing
+            board = start_board(3, 3)
+            write_book(path, {hash_board(board, 1): (2, 0)}, rows=3, cols=3)
+            bot = PlayerOne(book=path)
+            self.assertEqual(bot.get_play(board), (2, 0))
+            board[2][0] = 1
+            self.assertEqual(bot.get_play(board), PlayerOne().get_play(board))
+            bot.book.close()
+
+            with open(path, 'wb') as f:
+                f.write(b'not a book at all')
+            self.assertRaises(ValueError, OpeningBook, path)
+
+    def test_mcts(self):
+        # the playouts find the move that wipes out player 2
+        board = [[0, 2, -2, 0, 0, 0],
+                 [0, 0, -3, -1, 0, 0],
+                 [0, 0, 0, 0, 0, 0],
+                 [0, 0, 0, 0, 2, 0],
+                 [0, 0, 0, 2, 0, 0]]
+        tree = MCTS(board, 1, playouts=300, seed=1)
+        row, col = tree.get_move()
+        self.assertEqual(tree.completed, 300)
+        self.assertEqual(tree.root.visits, 300)
+        child = [r[:] for r in board]
+        child[row][col] += 1
+        overflow(child, Queue())
+        self.assertFalse(any(v < 0 for r in child for v in r))
+        self.assertEqual(tree.board.to_lists(), board)  # every playout was taken back
+
+        # out of time before the first playout, it still answers with a valid move
+        tree = MCTS(board, -1, time_limit=0)
+        row, col = tree.get_move()
+        self.assertEqual(tree.completed, 0)
+        self.assertLessEqual(board[row][col], 0)
+
+        # the tree is kept for the position after the move and a reply it has looked at
+        board = random_board(random.Random(14), 4, 4, 0.5)
+        board[0][0], board[3][3] = 1, -1
+        tree = MCTS(board, 1, playouts=400, seed=2)
+        row, col = tree.get_move()
+        child = max(tree.root.children, key=lambda node: node.visits)
+        reply = max(child.children, key=lambda node: node.visits)
+        position = SearchBoard(board, 1, "game")
+        position.play(child.move)
+        position.play(reply.move)
+        self.assertTrue(tree.reroot(position.to_lists()))
+        self.assertIs(tree.root, reply)
+        self.assertGreater(tree.root.visits, 0)
+        self.assertFalse(tree.reroot(board))
+
+        bot = PlayerOne(engine="mcts", playouts=50)
+        row, col = bot.get_play(board)
+        self.assertGreaterEqual(board[row][col], 0)
+        self.assertIsNotNone(bot.mcts)
+        self.assertRaises(ValueError, PlayerOne, engine="minimax")
+
+    def test_endgame_solver(self):
+        solver = EndgameSolver(node_limit=10000)
+        win_in_1 = [[1, 0, 2, -1], [-1, -3, 3, -2], [-1, -2, -1, 0]]
+        self.assertEqual(solver.solve(SearchBoard(win_in_1, 1, "game")), (EndgameSolver.WIN, 1, 2))
+        loss_in_2 = [[1, -2, -1, -1], [2, 0, -2, 1], [-1, 2, 2, 1]]
+        self.assertEqual(solver.solve(SearchBoard(loss_in_2, 1, "game")), (EndgameSolver.LOSS, 2, None))
+        win_in_3 = [[1, 0, -1, -1], [2, -1, -1, 2], [-1, -2, -1, 1]]
+        board = SearchBoard(win_in_3, 1, "game")
+        self.assertEqual(solver.solve(board), (EndgameSolver.WIN, 3, 0))
+        self.assertEqual(board.to_lists(), win_in_3)
+        self.assertGreater(solver.nodes, 1)
+        self.assertEqual(solver.solve(board), (EndgameSolver.WIN, 3, 0))
+        self.assertEqual(solver.nodes, 1)  # found in the table
+
+        # out of nodes, nothing is proven and the board is put back
+        board = SearchBoard(win_in_3, 1, "game")
+        self.assertEqual(EndgameSolver(node_limit=5).solve(board)[0], EndgameSolver.UNKNOWN)
+        self.assertEqual(board.to_lists(), win_in_3)
+
+        # a GameTree plays the proven win, and scores proven positions without searching them
+        fresh = EndgameSolver()
+        tree = GameTree(win_in_3, 1, lazy=True, rules="game", solver=fresh, endgame_moves=8)
+        self.assertEqual(tree.get_move(), (0, 0))
+        self.assertEqual(tree.endgame[0], EndgameSolver.WIN)
+        self.assertEqual(tree.nodes, fresh.nodes)  # only the solve, no search
+        tree = GameTree(win_in_3, 1, lazy=True, rules="game", solver=solver)
+        self.assertEqual(tree.get_move(), (0, 0))
+        self.assertIsNone(tree.endgame)  # endgame_moves is 0, so the solver was not run
+        plain = GameTree(win_in_3, 1, lazy=True, rules="game")
+        plain.get_move()
+        self.assertLess(tree.nodes, plain.nodes)
+        self.assertRaises(ValueError, GameTree, win_in_3, 1, lazy=True, solver=solver)
+
+        # the solve is held to the tree's budget: a stopped search does not solve, and the solver
+        # gets at most half of the nodes
+        stop_event = threading.Event()
+        stop_event.set()
+        tree = GameTree(win_in_3, 1, lazy=True, rules="game", solver=EndgameSolver(), endgame_moves=8,
+                        stop_event=stop_event)
+        tree.get_move()
+        self.assertEqual(tree.endgame[0], EndgameSolver.UNKNOWN)
+        tree = GameTree(win_in_3, 1, lazy=True, rules="game", solver=EndgameSolver(), endgame_moves=8,
+                        node_limit=20)
+        tree.get_move()
+        self.assertEqual(tree.endgame[0], EndgameSolver.UNKNOWN)
+        self.assertLessEqual(tree.nodes, 20)
+
+        # the table never holds more than max_entries positions
+        small = EndgameSolver(max_entries=3)
+        small.solve(SearchBoard(win_in_3, 1, "game"))
+        self.assertEqual(len(small), 3)
 
 if __name__ == '__main__':
     unittest.main()